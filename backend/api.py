@@ -1,23 +1,73 @@
-import sqlite3
-
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from pydantic import BaseModel, Field, ValidationError
-from typing import Optional, List
-from utils.history import Histories, History  # Import the SQLite-based setup
+from typing import Optional, List, Literal
+from utils.history import Histories, History, project_key  # Import the SQLite-based setup
+import asyncio
+import json
+import sqlite3
 import time
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 import os
+import zlib
 from langchain_community.callbacks import get_openai_callback
 from dotenv import load_dotenv
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from utils.milestone import MilestonePlanning
+from fastapi.encoders import jsonable_encoder
+from utils.milestone import MilestonePlanning, ListOfMilestones
+from utils import clients
+from utils.cache import ResponseCache
+from utils.embeddings import EmbeddingStore
+from utils.ratelimit import RateLimiter
+from utils.summarize import Summarizer
+from utils.metrics import metrics, request_timings
+from utils.singleflight import SingleFlight, KeyedLock
+from utils.semantic import PlanIndexer, ProjectIndex, SemanticPlanCache
+from utils.incremental import touched_milestones
+from utils.jobs import JobQueue, JobWorkers, SUCCEEDED, FAILED
+from utils.router import ModelRouter
+from utils.prompts import PromptBuilder
+from utils.writer import WriteBehindHistories
+from utils.export import gzip_ndjson, NDJSONReader, history_from_record
+
+try:
+    # Plans are encoded with orjson when it is installed
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as PlanResponse
+except ImportError:
+    PlanResponse = JSONResponse
 
 # Load environment variables from .env file
 load_dotenv(".env")
 
 app = FastAPI()
 
+TIMING_HEADERS = os.environ.get("TIMING_HEADERS", "").lower() in ("1", "true", "yes")
+
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """
+    Records request latency and, when enabled globally or asked for with an
+    `X-Timing` header, reports per-stage durations in a Server-Timing header.
+    """
+    timings = {}
+    token = request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    # Label by route template so path parameters do not explode the label space
+    route = request.scope.get("route")
+    metrics.observe("http_request_duration_seconds", time.perf_counter() - start,
+                    path=getattr(route, "path", request.url.path))
+
+    if timings and (TIMING_HEADERS or request.headers.get("x-timing")):
+        response.headers["Server-Timing"] = ", ".join(
+            f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings.items())
+    return response
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -26,29 +76,115 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize models and embeddings with proper error handling
-try:
-    model_4o = AzureChatOpenAI(
-        openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-        azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
-        api_key=os.environ["AZURE_OPENAI_API_KEY"],
-        azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
-    )
+# Chat and embedding clients are built lazily on first use and shared across requests
+# (see utils.clients), so importing this module does not touch Azure at all
+
+# Chat calls go through a router that prefers the requested deployment, hedges slow
+# calls onto another configured deployment and fails over on throttling or outages
+router = ModelRouter(
+    slo=float(os.environ.get("MODEL_ROUTER_SLO_SECONDS", 20)),
+    hedge=os.environ.get("MODEL_ROUTER_HEDGE", "true").lower() in ("1", "true", "yes"),
+    hedge_after=float(os.environ.get("MODEL_ROUTER_HEDGE_AFTER_SECONDS", 15)),
+    failure_threshold=int(os.environ.get("MODEL_ROUTER_FAILURE_THRESHOLD", 5)),
+    cooldown=float(os.environ.get("MODEL_ROUTER_COOLDOWN_SECONDS", 30)),
+    retries=int(os.environ.get("MODEL_ROUTER_RETRIES", 2)),
+)
 
-    embeddings = AzureOpenAIEmbeddings(
-        openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-        azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
-        model="text-embedding-ada-002"
+# Initialize the Histories object for database operations using SQLite. With
+# HISTORY_WRITE_BEHIND set, plan writes are queued and group-committed by a
+# background thread instead of running inside the request. Every revision of a
+# plan is kept, up to HISTORY_MAX_VERSIONS per project (0 keeps them all); with
+# HISTORY_MAX_VERSION_AGE set, revisions older than that many seconds are dropped
+# hourly, apart from each plan's latest one
+HISTORY_MAX_VERSIONS = int(os.environ.get("HISTORY_MAX_VERSIONS", 20))
+HISTORY_MAX_VERSION_AGE = int(os.environ.get("HISTORY_MAX_VERSION_AGE", 0))
+if os.environ.get("HISTORY_WRITE_BEHIND", "").lower() in ("1", "true", "yes"):
+    hms = WriteBehindHistories(
+        max_batch=int(os.environ.get("HISTORY_WRITE_BEHIND_MAX_BATCH", 256)),
+        max_delay=float(os.environ.get("HISTORY_WRITE_BEHIND_DELAY_MS", 20)) / 1000,
+        max_versions=HISTORY_MAX_VERSIONS,
     )
-except KeyError as e:
-    raise RuntimeError(f"Environment variable {e.args[0]} not set.") from e
-except Exception as e:
-    raise RuntimeError(f"Failed to initialize Azure OpenAI services: {str(e)}") from e
+else:
+    hms = Histories(max_versions=HISTORY_MAX_VERSIONS)
+
+# Cache for LLM responses, stored next to history.db
+llm_cache = ResponseCache(
+    os.path.join(os.path.dirname(hms.db_loc), 'llm_cache.db'),
+    ttl=int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600)),
+    max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 5000)),
+)
+
+# Memoized embeddings so repeat evaluations do not call the embedding model again
+embedding_store = EmbeddingStore(
+    db_loc=os.path.join(os.path.dirname(hms.db_loc), 'embeddings.db'),
+    max_memory_entries=int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 2048)),
+    ttl=int(os.environ.get("EMBEDDING_STORE_TTL", 30 * 24 * 3600)),
+    max_entries=int(os.environ.get("EMBEDDING_STORE_MAX_ENTRIES", 20000)),
+)
+
+# Every model-bound prompt is fitted to a per-stage input token budget
+prompt_builder = PromptBuilder({
+    "summary": int(os.environ.get("PROMPT_BUDGET_SUMMARY", 6000)),
+    "extract": int(os.environ.get("PROMPT_BUDGET_EXTRACT", 3000)),
+    "modify": int(os.environ.get("PROMPT_BUDGET_MODIFY", 4000)),
+})
+
+# Summaries are skipped for short descriptions and extractive (local) otherwise,
+# unless the request opts into the chat model
+summarizer = Summarizer(
+    cache=llm_cache,
+    skip_below_tokens=int(os.environ.get("SUMMARY_SKIP_BELOW_TOKENS", 300)),
+    max_sentences=int(os.environ.get("SUMMARY_MAX_SENTENCES", 6)),
+    prompt_builder=prompt_builder,
+)
+
+# New projects close enough to an already planned one reuse its stored plan without
+# a chat completion. Set SEMANTIC_CACHE_THRESHOLD above 1 to disable. Plans are only
+# reused across users with SEMANTIC_CACHE_SCOPE=global
+semantic_cache = SemanticPlanCache(
+    ProjectIndex(os.path.join(os.path.dirname(hms.db_loc), 'projects_index.db'),
+                 approximate=os.environ.get("SEMANTIC_CACHE_APPROXIMATE", "").lower() in ("1", "true", "yes")),
+    threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95)),
+    scope=os.environ.get("SEMANTIC_CACHE_SCOPE", "user"),
+)
+
+
+def semantic_cache_enabled():
+    return semantic_cache is not None and semantic_cache.threshold <= 1
+
+
+# Plans are embedded and indexed in the background, never inside the write that saved them
+plan_indexer = PlanIndexer(semantic_cache, embedding_store.embed_many)
+
+
+def index_saved_plans(history_objs):
+    # Every committed plan, however it was written, becomes reusable
+    if semantic_cache_enabled():
+        plan_indexer.submit([(history_obj.user_id, history_obj.project_key, history_obj.project_id)
+                             for history_obj in history_objs])
+
+
+hms.add_listener(index_saved_plans)
 
-embedding_model = embeddings.embed_query
+# In-process coalescing of identical generations and per-(user, project) serialization
+generation_flights = SingleFlight()
+project_locks = KeyedLock()
 
-# Initialize the Histories object for database operations using SQLite
-hms = Histories()
+# Default model-call budget for /generate_milestones_batch/
+BATCH_REQUESTS_PER_MINUTE = int(os.environ.get("BATCH_REQUESTS_PER_MINUTE", 120))
+
+# Durable queue for /jobs/ requests. Workers run inside the API process unless
+# MILESTONE_JOB_WORKERS is 0, in which case `python worker.py` processes the queue
+job_queue = JobQueue(
+    os.path.join(os.path.dirname(hms.db_loc), 'jobs.db'),
+    lease_seconds=int(os.environ.get("MILESTONE_JOB_LEASE_SECONDS", 60)),
+    max_attempts=int(os.environ.get("MILESTONE_JOB_MAX_ATTEMPTS", 3)),
+    # Finished jobs are deleted after this many seconds; 0 keeps them
+    retention_seconds=int(os.environ.get("MILESTONE_JOB_RETENTION_SECONDS", 7 * 24 * 3600)) or None,
+)
+MILESTONE_JOB_WORKERS = int(os.environ.get("MILESTONE_JOB_WORKERS", 2))
+job_workers = None
+version_compactor = None
 
 
 class HistoryModel(BaseModel):
@@ -58,8 +194,25 @@ class HistoryModel(BaseModel):
     history: str
 
 
-# Path to SQLite database
-DB_PATH = 'history.db'
+class HistoryRecord(BaseModel):
+    id: str
+    user_id: str
+    project_id: str
+    project_key: str
+    history: str
+    milestones: Optional[List[dict]] = None
+
+
+class HistoryPage(BaseModel):
+    items: List[HistoryRecord]
+    next_cursor: Optional[int] = None
+
+
+class HistoryVersion(BaseModel):
+    version: int
+    created_at: float
+    history: Optional[str] = None
+    milestones: Optional[List[dict]] = None
 
 
 class RequestData(BaseModel):
@@ -69,7 +222,18 @@ class RequestData(BaseModel):
     modifying_prompt: Optional[str] = Field(None, description="Prompt for modifying the milestones")
     total_weeks: int = Field(6, description="Total number of weeks for the milestones", ge=3, le=16)
     evaluate: bool = Field(False, description="Whether to evaluate the milestones or not")
-    model: str = Field("GPT 4o", description="The model to use for milestone generation")
+    model: Literal[tuple(clients.CHAT_DEPLOYMENTS)] = Field(clients.DEFAULT_CHAT_MODEL,
+                                                           description="The model to use for milestone generation")
+    evaluation_mode: Literal["overall", "per_milestone"] = Field(
+        "overall", description="Score the plan as a whole or each milestone separately")
+    llm_summary: bool = Field(False, description="Summarize the description with the chat model instead of locally")
+    incremental: bool = Field(True, description="Regenerate only the milestones a modifying prompt refers to")
+
+
+class BatchRequestData(BaseModel):
+    items: List[RequestData] = Field(..., description="Requests to generate milestones for")
+    max_concurrency: int = Field(4, description="Maximum number of items processed at once", ge=1, le=32)
+    requests_per_minute: Optional[int] = Field(None, description="Upper bound on model calls per minute", ge=1)
 
 
 class MilestoneModel(BaseModel):
@@ -83,104 +247,485 @@ class MilestoneModel(BaseModel):
     project_id: str
 
 
-@app.post("/generate_milestones/")
-def generate_milestones(request: RequestData):
-    global hms
-    score = -1
+def build_planner(request: RequestData, model, summarized_description):
+    return MilestonePlanning(
+        detailed=request.project_description,
+        summarized=summarized_description,
+        total_weeks=request.total_weeks,  # Pass the total weeks here
+        model=model,
+        cache=llm_cache,
+        embedding_store=embedding_store,
+        prompt_builder=prompt_builder,
+    )
+
+
+async def previous_output(request: RequestData, milestones=None):
+    """
+    Returns the stored plan text a modifying prompt should be applied to, if any.
+    """
+    if not request.modifying_prompt:
+        return None
+    if milestones:
+        return hms.convert_milestones_to_plain_text(milestones)
+    with metrics.timer("sqlite_read"):
+        last_op_txt = await hms.aget_history(str(request.user_id), request.project_description)
+    return last_op_txt if last_op_txt else None
+
+
+async def previous_milestones(request: RequestData):
+    """
+    Returns the stored milestone rows of the plan an incremental modification applies to.
+    """
+    if not (request.modifying_prompt and request.incremental):
+        return []
+    with metrics.timer("sqlite_read"):
+        return await hms.aget_milestones(str(request.user_id), request.project_description)
+
+
+async def summarize(request: RequestData, model):
+    """
+    Returns `(summary, strategy, cached, tokens_trimmed)`, recording stage time and any tokens spent.
+    """
+    with metrics.timer("summarize"), get_openai_callback() as cb:
+        result = await summarizer.asummarize(model, request.project_description, use_llm=request.llm_summary)
+    metrics.record_usage(cb, stage="summarize")
+    return result
+
+
+async def evaluate_plan(request: RequestData, pdt):
+    """
+    Returns the plan score and, in per-milestone mode, the detailed evaluation.
+    """
+    if not request.evaluate:
+        return -1, None
+    with metrics.timer("evaluate"):
+        if request.evaluation_mode == "per_milestone":
+            milestone_evaluation = await pdt.aevaluate_per_milestone(with_summary=True)
+            return milestone_evaluation["average_similarity"], milestone_evaluation
+        return await pdt.aevaluate_milestones(with_summary=True), None
+
+
+def plan_history(request: RequestData, pdt):
+    return History(pdt._textify_milestones(), request.user_id, request.project_description,
+                   milestones=pdt._structured_milestones())
+
+
+async def save_plan(request: RequestData, pdt):
+    last_op = plan_history(request, pdt)
+    with metrics.timer("sqlite_write"):
+        await hms.ainsert_history(last_op)
+    return last_op
+
+
+def plan_records(lm, total_weeks):
+    with metrics.timer("serialize"):
+        return lm.records(total_weeks)
+
+
+async def semantic_lookup(request: RequestData):
+    """
+    Embeds the description and returns `(vector, match)`, where `match` is
+    `(similarity, stored milestone rows)` of the closest planned project or None.
+    """
+    if not semantic_cache_enabled() or request.modifying_prompt:
+        return None, None
+    with metrics.timer("semantic_lookup"):
+        vector = (await embedding_store.aembed_many([request.project_description]))[0]
+        match = await asyncio.to_thread(semantic_cache.lookup, vector, str(request.user_id),
+                                        exclude=project_key(request.project_description))
+        if match is None:
+            return vector, None
+        user_id, key, similarity = match
+        records = await hms.aget_milestones_by_key(user_id, key)
+    return vector, ((similarity, records) if records else None)
+
+
+def token_usage(cb):
+    return {
+        "total_tokens": cb.total_tokens,
+        "prompt_tokens": cb.prompt_tokens,
+        "completion_tokens": cb.completion_tokens,
+        "successful_requests": cb.successful_requests,
+        "total_cost": cb.total_cost,
+    }
+
+
+async def run_generation(request: RequestData, limiter=None, save=True):
+    """
+    Runs the summarize, extract and evaluate stages for one request.
+
+    Returns the response body and the History row for the new plan, which is only
+    written here when `save` is set. Each model-bound stage waits on `limiter` if given.
+    """
     start = time.time()
 
-    model = model_4o
+    model = router.model(request.model)
+
+    vector, match = await semantic_lookup(request)
+    if match is not None:
+        # A near-duplicate project was planned before: reuse its plan, weeks are redistributed below
+        similarity, records = match
+        regenerated = None
+        summarized_description, summary_strategy, summary_cached, summary_trimmed = \
+            request.project_description, "semantic", False, 0
+        pdt = build_planner(request, model, summarized_description)
+        pdt.reuse_milestones(ListOfMilestones.from_records(records))
+        lm = pdt.list_of_milestones
+    else:
+        similarity = None
+        # Generate the summarized description; only an LLM summary spends a model call
+        if limiter is not None and \
+                summarizer.strategy(request.project_description, request.llm_summary) == Summarizer.LLM:
+            await limiter.acquire()
+        summarized_description, summary_strategy, summary_cached, summary_trimmed = await summarize(request, model)
+
+        pdt = build_planner(request, model, summarized_description)
+        previous = await previous_milestones(request)
+        regenerated = touched_milestones(request.modifying_prompt, previous)
+        if limiter is not None:
+            await limiter.acquire()
+        if regenerated:
+            # Only the milestones the prompt refers to are rewritten and spliced into the stored plan
+            with metrics.timer("extract"):
+                lm = await pdt.aregenerate_milestones(request.modifying_prompt,
+                                                      ListOfMilestones.from_records(previous), regenerated)
+        else:
+            model_last_output = await previous_output(request, previous)
+            with metrics.timer("extract"):
+                lm = await pdt.aextract_milestones(modifying_prompt=request.modifying_prompt or None,
+                                                   model_last_output=model_last_output)
+        if isinstance(lm, Exception):
+            raise lm
+        metrics.record_usage(pdt.callbacks, stage="extract")
+
+    if limiter is not None and request.evaluate:
+        await limiter.acquire()
+    score, milestone_evaluation = await evaluate_plan(request, pdt)
+
+    generated_milestones = plan_records(lm, request.total_weeks)
+    if save:
+        last_op = await save_plan(request, pdt)
+    else:
+        last_op = plan_history(request, pdt)
+    if vector is not None:
+        semantic_cache.record(hit=match is not None, seconds=time.time() - start)
+    elapsed_time = round(time.time() - start, 2)
+
+    cb = pdt.callbacks
+
+    return {
+        "average_cosine_similarity": score,
+        "milestone_evaluation": milestone_evaluation,
+        "generation_time": elapsed_time,
+        "generated_milestones": generated_milestones,
+        "raw_milestones": str(lm),
+        "callbacks": str(cb),
+        "cached": {"summary": summary_cached, "milestones": pdt.cache_hit},
+        "summary_strategy": summary_strategy,
+        "semantic_cache": {"hit": match is not None, "similarity": similarity},
+        "regenerated_milestones": regenerated,
+        "tokens_trimmed": summary_trimmed + pdt.tokens_trimmed,
+    }, last_op
+
+
+def project_lock_key(user_id, project_description):
+    return str(user_id), project_key(project_description)
+
+
+async def serialized_generation(request: RequestData):
+    # Generations for the same user and project run one at a time, so a modify
+    # request always reads the history written by the one before it
+    async with project_locks.hold(project_lock_key(request.user_id, request.project_description)):
+        result, _ = await run_generation(request)
+        return result
+
 
+@app.post("/generate_milestones/")
+async def generate_milestones(request: RequestData):
     try:
-        # Generate the summarized description using the model
-        summarized_description = model.invoke(
-            f"Summarize the following project description: {request.project_description}")
-
-        if not request.modifying_prompt:
-            pdt = MilestonePlanning(
-                detailed=request.project_description,
-                summarized=summarized_description,
-                total_weeks=request.total_weeks,  # Pass the total weeks here
-                model=model,
-                embedding_model=embedding_model
-            )
-            lm = pdt.extract_milestones()
-            if request.evaluate:
-                score = pdt.evaluate_milestones(with_summary=True)
-
-            df = lm.dataframe(request.total_weeks)
-            last_op = History(pdt._textify_milestones(), request.user_id, request.project_description)
-            hms.insert_history(last_op)
-            elapsed_time = time.time() - start
-        else:
-            last_op_txt = hms.get_history(str(request.user_id), request.project_description)
-            pdt = MilestonePlanning(
-                detailed=request.project_description,
-                summarized=summarized_description,
-                total_weeks=request.total_weeks,  # Pass the total weeks here
-                model=model,
-                embedding_model=embedding_model
-            )
-            lm = pdt.extract_milestones(modifying_prompt=request.modifying_prompt,
-                                        model_last_output=last_op_txt if last_op_txt else None)
-            if request.evaluate:
-                score = pdt.evaluate_milestones(with_summary=True)
-
-            df = lm.dataframe(request.total_weeks)
-            last_op = History(pdt._textify_milestones(), request.user_id, request.project_description)
-            hms.insert_history(last_op)
-            elapsed_time = round(time.time() - start, 2)
-
-        cb = pdt.callbacks
-
-        return {
-            "average_cosine_similarity": score,
-            "generation_time": elapsed_time,
-            "generated_milestones": df.to_dict(orient="records"),
-            "raw_milestones": str(lm),
-            "callbacks": str(cb)
-        }
+        # Identical requests already in flight share a single pipeline execution
+        flight_key = (
+            *project_lock_key(request.user_id, request.project_description),
+            request.total_weeks, request.modifying_prompt or None,
+            request.evaluate, request.evaluation_mode, request.model, request.llm_summary, request.incremental,
+        )
+        result, shared = await generation_flights.do(flight_key, lambda: serialized_generation(request))
+        # The body is already JSON-ready, so it is encoded once without jsonable_encoder
+        return PlanResponse({**result, "coalesced": shared})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred while processing the request: {str(e)}")
 
 
-@app.post("/update_milestone/")
-def update_milestone(milestone: MilestoneModel):
+@app.post("/generate_milestones_batch/")
+async def generate_milestones_batch(batch: BatchRequestData):
+    """
+    Generates plans for many requests concurrently and streams one NDJSON line per item
+    as it finishes. All successful plans are then saved in a single transaction.
+    """
+    semaphore = asyncio.Semaphore(batch.max_concurrency)
+    limiter = RateLimiter(batch.requests_per_minute or BATCH_REQUESTS_PER_MINUTE)
+
+    async def run_item(index, item):
+        async with semaphore:
+            try:
+                result, last_op = await run_generation(item, limiter=limiter, save=False)
+                return index, {"index": index, "status": "ok", "result": result}, last_op
+            except Exception as e:
+                return index, {"index": index, "status": "error",
+                               "detail": f"An error occurred while processing the request: {str(e)}"}, None
+
+    async def lines():
+        tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(batch.items)]
+        histories = []
+        try:
+            for finished in asyncio.as_completed(tasks):
+                index, line, last_op = await finished
+                if last_op is not None:
+                    histories.append(last_op)
+                yield json.dumps(jsonable_encoder(line)) + "\n"
+
+            await hms.ainsert_histories(histories)
+            yield json.dumps({"status": "saved", "count": len(histories)}) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+@app.post("/generate_milestones/stream/")
+async def generate_milestones_stream(request: RequestData):
+    """
+    Streams plan generation as Server-Sent Events: summary, one event per milestone
+    as soon as it is complete, evaluation, token usage and finally the full plan.
+    """
+    model = router.model(request.model)
+
+    async def events():
+        start = time.time()
+        try:
+            async with project_locks.hold(project_lock_key(request.user_id, request.project_description)):
+                async for event in generation_events(start):
+                    yield event
+        except Exception as e:
+            yield sse_event("error", {"detail": f"An error occurred while processing the request: {str(e)}"})
+
+    async def generation_events(start):
+        summarized_description, summary_strategy, summary_cached, summary_trimmed = await summarize(request, model)
+        yield sse_event("summary", {"summary": summarized_description, "strategy": summary_strategy,
+                                    "cached": summary_cached})
+
+        pdt = build_planner(request, model, summarized_description)
+        model_last_output = await previous_output(request)
+        with metrics.timer("extract"):
+            async for milestone in pdt.astream_milestones(modifying_prompt=request.modifying_prompt or None,
+                                                          model_last_output=model_last_output):
+                yield sse_event("milestone", {
+                    "index": milestone.index,
+                    "title": milestone.title,
+                    "description": milestone.description,
+                    "time": milestone.time,
+                    "roles": [role.roles for role in milestone.roles],
+                    "deliverables": milestone.deliverables,
+                })
+        metrics.record_usage(pdt.callbacks, stage="extract")
+
+        if request.evaluate:
+            score, milestone_evaluation = await evaluate_plan(request, pdt)
+            yield sse_event("evaluation", {"average_cosine_similarity": score,
+                                           "milestone_evaluation": milestone_evaluation})
+
+        yield sse_event("usage", {**token_usage(pdt.callbacks), "cached": pdt.cache_hit,
+                                  "tokens_trimmed": summary_trimmed + pdt.tokens_trimmed})
+
+        generated_milestones = plan_records(pdt.list_of_milestones, request.total_weeks)
+        await save_plan(request, pdt)
+        yield sse_event("done", {
+            "generation_time": round(time.time() - start, 2),
+            "generated_milestones": generated_milestones,
+        })
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def run_generation_job(payload):
+    result = await serialized_generation(RequestData(**payload))
+    return jsonable_encoder(result)
+
+
+JOB_HANDLERS = {"generate_milestones": run_generation_job}
+
+
+@app.post("/jobs/generate_milestones/", status_code=202)
+async def enqueue_generate_milestones(request: RequestData):
+    """
+    Queues a plan generation and returns its job id immediately. Poll /jobs/{job_id}
+    or subscribe to /jobs/{job_id}/events for the result.
+    """
     try:
-        # Get the existing history for the project and user
-        existing_history = hms.get_history(milestone.user_id, milestone.project_id)
-        if not existing_history:
-            raise HTTPException(status_code=404, detail="History not found for the specified user and project.")
+        job_id = await job_queue.aenqueue("generate_milestones", request.dict())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while queueing the request: {str(e)}")
+    if job_workers is not None:
+        job_workers.notify()
+    return {"job_id": job_id, "status": "queued"}
+
 
-        # Update the specific milestone within the history
-        updated_history = hms.update_specific_milestone(existing_history, milestone.dict())
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.aget(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
 
-        # Save the updated history back to the database
-        milestone_obj = History(updated_history, milestone.user_id, milestone.project_id)
-        hms.update_history(milestone_obj)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, poll_interval: float = Query(0.5, ge=0.1, le=10)):
+    """
+    Streams a job's status changes as Server-Sent Events, ending with `done` and the
+    generation result or `error`.
+    """
+    if await job_queue.aget(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def events():
+        last_status = None
+        idle = 0.0
+        while True:
+            job = await job_queue.aget(job_id)
+            if job["status"] != last_status:
+                last_status = job["status"]
+                idle = 0.0
+                yield sse_event("status", {"status": last_status, "attempts": job["attempts"]})
+            if last_status == SUCCEEDED:
+                yield sse_event("done", job["result"])
+                return
+            if last_status == FAILED:
+                yield sse_event("error", {"detail": f"An error occurred while processing the request: {job['error']}"})
+                return
+
+            await asyncio.sleep(poll_interval)
+            idle += poll_interval
+            if idle >= 15:
+                # Comment line so proxies do not close an idle stream
+                idle = 0.0
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/update_milestone/")
+async def update_milestone(milestone: MilestoneModel):
+    try:
+        milestone_data = milestone.dict(include={"index", "title", "description", "roles", "deliverables", "time"})
+
+        # A single indexed UPDATE of the stored milestone row, no re-parsing of the plan
+        async with project_locks.hold(project_lock_key(milestone.user_id, milestone.project_id)):
+            with metrics.timer("sqlite_write"):
+                updated = await hms.aupdate_milestone(milestone.user_id, milestone.project_id, milestone_data)
+        if not updated:
+            raise HTTPException(status_code=404, detail="History not found for the specified user and project.")
 
         return {"status": "success", "message": "Milestone updated successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred while updating the milestone: {str(e)}")
 
 
-@app.get("/get_all_histories/", response_model=List[HistoryModel])
-def get_all_histories():
+@app.get("/histories/", response_model=HistoryPage)
+async def list_histories(user_id: str, cursor: Optional[int] = None, limit: int = Query(50, ge=1, le=200)):
+    """
+    Lists a user's plans one page at a time. Pass the returned `next_cursor` back as
+    `cursor` for the following page; it is null on the last one.
+    """
+    try:
+        with metrics.timer("sqlite_read"):
+            records, next_cursor = await hms.alist_histories(user_id, cursor or 0, limit)
+        return {"items": records, "next_cursor": next_cursor}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while retrieving histories: {str(e)}")
+
+
+@app.get("/histories/export")
+def export_histories(user_id: Optional[str] = None):
+    """
+    Streams every plan, or every plan of `user_id`, as gzip-compressed NDJSON.
+    """
+    return StreamingResponse(gzip_ndjson(hms.export_histories(user_id)), media_type="application/gzip",
+                             headers={"Content-Disposition": 'attachment; filename="histories.ndjson.gz"'})
+
+
+@app.post("/histories/import")
+async def import_histories(request: Request, batch_size: int = Query(500, ge=1, le=5000)):
     """
-    Fetches all histories from the SQLite database.
+    Loads an export (gzip-compressed or plain NDJSON) from the request body, writing
+    `batch_size` plans per transaction.
     """
+    reader = NDJSONReader()
+    batch = []
+    imported = 0
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        async for chunk in request.stream():
+            for record in reader.feed(chunk):
+                batch.append(history_from_record(record))
+                if len(batch) >= batch_size:
+                    await hms.ainsert_histories(batch)
+                    imported += len(batch)
+                    batch = []
+        batch.extend(history_from_record(record) for record in reader.close())
+        await hms.ainsert_histories(batch)
+        imported += len(batch)
+    except (ValueError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid export after {imported} plans: {str(e)}")
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred after importing {imported} plans: {str(e)}")
+    return {"status": "success", "imported": imported}
+
+
+@app.get("/histories/{user_id}/{key}/versions", response_model=List[HistoryVersion])
+async def list_history_versions(user_id: str, key: str):
+    """
+    Lists the retained revisions of a plan, oldest first, without their contents.
+    `key` is the plan's `project_key` as returned by /histories/.
+    """
+    with metrics.timer("sqlite_read"):
+        versions = await hms.aget_versions(user_id, key)
+    if not versions:
+        raise HTTPException(status_code=404, detail="History not found for the specified user and project.")
+    return [{"version": version, "created_at": created_at} for version, created_at in versions]
+
 
-        # Execute the query to retrieve all rows from the history table
-        c.execute('SELECT id, user_id, project_id, history FROM history')
-        rows = c.fetchall()
+@app.get("/histories/{user_id}/{key}/versions/{version}", response_model=HistoryVersion)
+async def get_history_version(user_id: str, key: str, version: str):
+    """
+    Returns one revision of a plan; `latest` is the current one.
+    """
+    if version != "latest" and not version.isdigit():
+        raise HTTPException(status_code=422, detail="version must be a number or 'latest'.")
+    with metrics.timer("sqlite_read"):
+        record = await hms.aget_version(user_id, key, None if version == "latest" else int(version))
+    if record is None:
+        raise HTTPException(status_code=404, detail="Version not found for the specified user and project.")
+    return record
 
-        # Close the database connection
-        conn.close()
+
+@app.get("/get_all_histories/", response_model=List[HistoryModel])
+async def get_all_histories():
+    """
+    Fetches all histories from the SQLite database. Prefer the paginated /histories/
+    and /histories/export, which do not load every plan into memory.
+    """
+    try:
+        with metrics.timer("sqlite_read"):
+            rows = await hms.aget_all_histories()
 
         # Map the rows to the HistoryModel Pydantic model
         histories = [HistoryModel(id=row[0], user_id=row[1], project_id=row[2], history=row[3]) for row in rows]
@@ -192,12 +737,66 @@ def get_all_histories():
         raise HTTPException(status_code=500, detail=f"An error occurred while retrieving histories: {str(e)}")
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Exposes stage latency histograms, token and cost counters and cache hit counts
+    in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health_check/")
 def health_check():
     """
-    Returns a simple "Ok" response to confirm the API is up and running.
+    Returns a simple "Ok" response to confirm the API is up and running, along with
+    the router's view of each chat deployment.
     """
-    return {"status": "Ok"}
+    return {"status": "Ok", "models": router.snapshot()}
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    global job_workers
+    if MILESTONE_JOB_WORKERS > 0:
+        job_workers = JobWorkers(job_queue, JOB_HANDLERS, concurrency=MILESTONE_JOB_WORKERS)
+        job_workers.start()
+
+
+@app.on_event("startup")
+async def backfill_semantic_index():
+    # Plans stored before the index existed, or while indexing failed, are added in the background
+    if semantic_cache_enabled():
+        plan_indexer.backfill(hms)
+
+
+async def compact_history_versions(interval=3600):
+    while True:
+        try:
+            await hms.acompact_versions(HISTORY_MAX_VERSION_AGE)
+        except sqlite3.Error:
+            # Locked or busy: old versions are only kept a little longer, try again next round
+            pass
+        await asyncio.sleep(interval)
+
+
+@app.on_event("startup")
+async def start_version_compactor():
+    global version_compactor
+    if HISTORY_MAX_VERSION_AGE > 0:
+        version_compactor = asyncio.create_task(compact_history_versions())
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    if version_compactor is not None:
+        version_compactor.cancel()
+    if job_workers is not None:
+        await job_workers.stop()
+    # Commits any queued history writes before the process exits
+    await asyncio.to_thread(hms.close)
+    await asyncio.to_thread(plan_indexer.close)
+    await clients.aclose()
 
 
 @app.exception_handler(ValidationError)
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import random
+import time
+
+import numpy as np
+from langchain_core.messages import AIMessage
+
+from utils.milestone import ListOfMilestones, people_roles
+
+
+def _seed(*parts):
+    digest = hashlib.sha256("\x00".join(str(part) for part in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+class Latency:
+    """
+    Deterministic latency source: a base delay plus seeded uniform jitter.
+    """
+
+    def __init__(self, base, jitter=0.0, seed=0):
+        self.base = base
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+    def next(self):
+        return max(0.0, self.base + self._random.uniform(-self.jitter, self.jitter))
+
+
+def fake_plan(prompt, max_milestones=6):
+    """
+    Builds a valid ListOfMilestones whose content depends only on the prompt.
+    """
+    rng = random.Random(_seed(prompt))
+    count = rng.randint(3, max_milestones)
+    milestones = []
+    for index in range(1, count + 1):
+        milestones.append({
+            "index": index,
+            "title": f"Milestone {index}: phase {rng.randint(100, 999)}",
+            "description": " ".join(f"task{rng.randint(0, 9999)}" for _ in range(rng.randint(20, 60))),
+            "time": rng.randint(1, 3),
+            "roles": [{"roles": role} for role in rng.sample(people_roles, rng.randint(1, 3))],
+            "deliverables": [f"deliverable {index}.{n}" for n in range(1, rng.randint(2, 4))],
+        })
+    return ListOfMilestones(milestones=milestones)
+
+
+class FakeStructuredModel:
+    def __init__(self, chat, schema):
+        self.chat = chat
+        self.schema = schema
+
+    def invoke(self, prompt):
+        time.sleep(self.chat.latency.next())
+        return fake_plan(prompt)
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(self.chat.latency.next())
+        return fake_plan(prompt)
+
+    async def astream(self, prompt, **kwargs):
+        plan = fake_plan(prompt)
+        # Spread the total latency over the milestones, like a token stream would
+        delay = self.chat.latency.next() / len(plan.milestones)
+        for count in range(1, len(plan.milestones) + 1):
+            await asyncio.sleep(delay)
+            yield ListOfMilestones(milestones=plan.milestones[:count])
+
+
+class FakeChatModel:
+    """
+    Stand-in for AzureChatOpenAI that answers locally after a simulated delay.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.1, seed=0, deployment_name="fake-chat"):
+        self.latency = Latency(latency, jitter, seed)
+        self.deployment_name = deployment_name
+
+    def _summary(self, prompt):
+        words = str(prompt).split()
+        return AIMessage(content=" ".join(words[:60]))
+
+    def invoke(self, prompt):
+        time.sleep(self.latency.next())
+        return self._summary(prompt)
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(self.latency.next())
+        return self._summary(prompt)
+
+    def with_structured_output(self, schema, method=None, **kwargs):
+        return FakeStructuredModel(self, schema)
+
+
+class FakeEmbeddings:
+    """
+    Stand-in for AzureOpenAIEmbeddings returning seeded unit vectors per text.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.01, seed=0, dimensions=1536, deployment="fake-embeddings"):
+        self.latency = Latency(latency, jitter, seed)
+        self.dimensions = dimensions
+        self.deployment = deployment
+        self.model = deployment
+
+    def _vector(self, text):
+        vector = np.random.default_rng(_seed(text)).standard_normal(self.dimensions).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_query(self, text):
+        time.sleep(self.latency.next())
+        return self._vector(text)
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency.next())
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency.next())
+        return self._vector(text)
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self.latency.next())
+        return [self._vector(text) for text in texts]
@@ -0,0 +1,258 @@
+"""
+Offline load test for the milestone API.
+
+Runs the FastAPI app in-process against deterministic fake chat and embedding
+models, so no Azure quota is used, and drives /generate_milestones/,
+/update_milestone/ and /get_all_histories/ at rising concurrency.
+
+    cd backend
+    python -m bench.loadtest --levels 1 8 32 --requests 200 --output bench.json
+    python -m bench.loadtest --baseline bench.json --tolerance 0.25
+
+With --baseline the run exits non-zero when throughput or p95 latency regress
+beyond the tolerance, which makes it usable as a CI gate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = ["e-commerce site", "fleet tracking dashboard", "chat assistant", "inventory forecaster",
+          "IoT greenhouse monitor", "invoice OCR pipeline", "recommendation engine", "mobile banking app"]
+FEATURES = ["user authentication", "payment integration", "real-time notifications", "an admin console",
+            "analytics reports", "a recommendation model", "image classification", "a public REST API"]
+
+
+def load_app(args):
+    """
+    Imports the API inside a scratch directory and swaps in the fake models.
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(tempfile.mkdtemp(prefix="milestone-bench-"))
+    if args.write_behind:
+        os.environ["HISTORY_WRITE_BEHIND"] = "1"
+
+    import api
+    from bench.fakes import FakeChatModel, FakeEmbeddings
+    from utils import clients
+
+    clients.set_chat_model(clients.DEFAULT_CHAT_MODEL,
+                           FakeChatModel(latency=args.chat_latency, jitter=args.jitter, seed=args.seed))
+    clients.set_embeddings(FakeEmbeddings(latency=args.embedding_latency, jitter=args.jitter / 10, seed=args.seed))
+    if not args.cache:
+        # Measure the full pipeline rather than cache hits
+        api.llm_cache = None
+        api.summarizer.cache = None
+        api.semantic_cache = None
+    return api
+
+
+def project_descriptions(rng, count):
+    descriptions = []
+    for number in range(count):
+        features = rng.sample(FEATURES, 3)
+        descriptions.append(
+            f"Project {number}: build a {rng.choice(TOPICS)} with {features[0]}, {features[1]} and {features[2]}. "
+            f"The team wants a first release in {rng.randint(4, 16)} weeks."
+        )
+    return descriptions
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize_latencies(values):
+    return {
+        "count": len(values),
+        "mean_ms": round(1000 * sum(values) / len(values), 2) if values else None,
+        "p50_ms": round(1000 * percentile(values, 0.50), 2) if values else None,
+        "p95_ms": round(1000 * percentile(values, 0.95), 2) if values else None,
+        "p99_ms": round(1000 * percentile(values, 0.99), 2) if values else None,
+    }
+
+
+def build_workload(rng, args, projects):
+    """
+    Returns a reproducible list of (endpoint, method, body) operations.
+    """
+    operations = []
+    for _ in range(args.requests):
+        roll = rng.random()
+        user_id, description = rng.choice(projects)
+        if roll < args.update_share:
+            operations.append(("/update_milestone/", "POST", {
+                "index": 1,
+                "title": f"Edited {rng.randint(0, 999)}",
+                "description": "Edited during the load test",
+                "roles": ["Backend Developer"],
+                "deliverables": ["bench"],
+                "time": 1,
+                "user_id": str(user_id),
+                "project_id": description,
+            }))
+        elif roll < args.update_share + args.list_share:
+            operations.append(("/get_all_histories/", "GET", None))
+        else:
+            body = {
+                "user_id": user_id,
+                "project_description": description,
+                "total_weeks": rng.randint(3, 16),
+                "evaluate": rng.random() < args.evaluate_share,
+            }
+            if rng.random() < args.modify_share:
+                body["modifying_prompt"] = f"Shorten milestone {rng.randint(1, 3)}"
+            operations.append(("/generate_milestones/", "POST", body))
+    return operations
+
+
+async def run_level(client, metrics, operations, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = {}
+    errors = {"total": 0, "locked": 0}
+
+    async def send(endpoint, method, body):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, endpoint, json=body)
+            latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors["total"] += 1
+                if "database is locked" in response.text:
+                    errors["locked"] += 1
+
+    metrics.reset()
+    start = time.perf_counter()
+    await asyncio.gather(*(send(*operation) for operation in operations))
+    elapsed = time.perf_counter() - start
+
+    sqlite = {}
+    for stage in ("sqlite_read", "sqlite_write"):
+        total, count = metrics.histogram_totals("milestone_stage_duration_seconds", stage=stage)
+        sqlite[f"{stage}_mean_ms"] = round(1000 * total / count, 3) if count else None
+    sqlite["locked_errors"] = errors["locked"]
+
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        "concurrency": concurrency,
+        "requests": len(operations),
+        "errors": errors["total"],
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(operations) / elapsed, 2),
+        "latency": summarize_latencies(everything),
+        "endpoints": {endpoint: summarize_latencies(values) for endpoint, values in sorted(latencies.items())},
+        "sqlite": sqlite,
+    }
+
+
+async def run(args):
+    import httpx
+
+    api = load_app(args)
+    from utils.metrics import metrics
+
+    rng = random.Random(args.seed)
+    projects = [(rng.randint(1, args.users), description)
+                for description in project_descriptions(rng, args.projects)]
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Every project gets a stored plan first so updates and modifications have a target
+        seed_operations = [("/generate_milestones/", "POST", {"user_id": user_id, "project_description": description})
+                           for user_id, description in projects]
+        await run_level(client, metrics, seed_operations, max(args.levels))
+
+        results = []
+        for concurrency in args.levels:
+            operations = build_workload(random.Random(args.seed + concurrency), args, projects)
+            result = await run_level(client, metrics, operations, concurrency)
+            results.append(result)
+            print(f"concurrency={concurrency:<4} rps={result['throughput_rps']:<8} "
+                  f"p50={result['latency']['p50_ms']}ms p95={result['latency']['p95_ms']}ms "
+                  f"p99={result['latency']['p99_ms']}ms errors={result['errors']}", file=sys.stderr)
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Returns a list of human-readable regressions against a previous report.
+    """
+    previous = {result["concurrency"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get(result["concurrency"])
+        if before is None:
+            continue
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"concurrency {result['concurrency']}: throughput "
+                               f"{before['throughput_rps']} -> {result['throughput_rps']} rps")
+        if before["latency"]["p95_ms"] and result["latency"]["p95_ms"] > before["latency"]["p95_ms"] * (1 + tolerance):
+            regressions.append(f"concurrency {result['concurrency']}: p95 "
+                               f"{before['latency']['p95_ms']} -> {result['latency']['p95_ms']} ms")
+        if result["errors"] > before["errors"]:
+            regressions.append(f"concurrency {result['concurrency']}: errors {before['errors']} -> {result['errors']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64], help="Concurrency levels to run")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--projects", type=int, default=40, help="Distinct project descriptions")
+    parser.add_argument("--users", type=int, default=10, help="Distinct user ids")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--chat-latency", type=float, default=0.2, help="Mean fake chat latency in seconds")
+    parser.add_argument("--embedding-latency", type=float, default=0.02, help="Mean fake embedding latency")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Uniform +/- jitter on chat latency")
+    parser.add_argument("--update-share", type=float, default=0.2)
+    parser.add_argument("--list-share", type=float, default=0.05)
+    parser.add_argument("--modify-share", type=float, default=0.3)
+    parser.add_argument("--evaluate-share", type=float, default=0.5)
+    parser.add_argument("--cache", action="store_true", help="Keep the LLM response cache enabled")
+    parser.add_argument("--write-behind", action="store_true", help="Queue history writes for group commit")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Previous JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The run changes into a scratch directory, so pin file arguments first
+    for name in ("output", "baseline"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    report = asyncio.run(run(args))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules are imported the way api.py imports them, relative to backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,49 @@
+import pytest
+
+from utils.incremental import touched_milestones
+
+MILESTONES = [
+    {"index": 1, "title": "Requirements and Research"},
+    {"index": 2, "title": "Data Pipeline"},
+    {"index": 3, "title": "Model Training"},
+    {"index": 4, "title": "Frontend Dashboard"},
+    {"index": 5, "title": "Deployment"},
+]
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("Change milestone 3 to 2 weeks", [3]),
+    ("Add more detail to milestone 2", [2]),
+    ("Shorten milestone 4 to 1 week", [4]),
+    ("Make milestone 2 to 4 weeks long", [2]),
+    ("Set milestone 2 to 10 days", [2]),
+    ("Give milestone 2, 3 weeks more", [2]),
+    ("Move milestone 4 to 1", [4]),
+    ("Use PyTorch in milestone #3", [3]),
+    ("Rework milestones 2 and 4", [2, 4]),
+    ("Rework milestones 2, 3 and 4", [2, 3, 4]),
+    ("Rework milestones 2-4", [2, 3, 4]),
+    ("Rework milestones 2 to 4", [2, 3, 4]),
+    ("Expand the 3rd milestone", [3]),
+    ("Expand the last milestone", [5]),
+    ("Use Kafka for the Data Pipeline", [2]),
+])
+def test_touched_milestones(prompt, expected):
+    assert touched_milestones(prompt, MILESTONES) == expected
+
+
+@pytest.mark.parametrize("prompt", [
+    "Add more detail to milestone 2 and add a milestone for testing",
+    "Remove milestone 3",
+    "Make every milestone shorter",
+    "Change milestone 9",
+    "Rework milestones 1-5",
+    "Make it better",
+    "",
+])
+def test_whole_plan_is_regenerated(prompt):
+    assert touched_milestones(prompt, MILESTONES) is None
+
+
+def test_nothing_stored():
+    assert touched_milestones("Change milestone 2", []) is None
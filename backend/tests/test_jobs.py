@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from utils.jobs import FAILED, JobQueue, QUEUED, RUNNING, SUCCEEDED
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"), lease_seconds=0.05, max_attempts=2)
+
+
+def test_expired_lease_hands_the_job_to_another_worker(queue):
+    job_id = queue.enqueue("generate_milestones", {"user_id": 1})
+    _, _, _, first_claim = queue.claim()
+    assert queue.claim() is None
+
+    time.sleep(0.1)
+    claimed_id, kind, payload, second_claim = queue.claim()
+    assert (claimed_id, kind, payload) == (job_id, "generate_milestones", {"user_id": 1})
+    assert queue.get(job_id)["attempts"] == 2
+
+    # The worker that lost its lease can neither renew nor finish the job
+    assert not queue.renew(job_id, first_claim)
+    queue.complete(job_id, first_claim, {"stale": True})
+    assert queue.get(job_id)["status"] == RUNNING
+
+    queue.complete(job_id, second_claim, {"ok": True})
+    assert queue.get(job_id)["status"] == SUCCEEDED
+    assert queue.get(job_id)["result"] == {"ok": True}
+
+
+def test_job_fails_once_its_lease_expired_max_attempts_times(queue):
+    job_id = queue.enqueue("generate_milestones", {})
+    for _ in range(2):
+        assert queue.claim() is not None
+        time.sleep(0.1)
+
+    assert queue.claim() is None
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["attempts"] == 2
+
+
+def test_released_job_is_queued_again_without_using_an_attempt(queue):
+    job_id = queue.enqueue("generate_milestones", {})
+    _, _, _, claim = queue.claim()
+    queue.release(job_id, claim)
+
+    assert queue.get(job_id)["status"] == QUEUED
+    assert queue.get(job_id)["attempts"] == 0
+
+
+def test_finished_jobs_are_purged_after_the_retention_period(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), retention_seconds=60)
+    finished = queue.enqueue("generate_milestones", {})
+    waiting = queue.enqueue("generate_milestones", {})
+    _, _, _, claim = queue.claim()
+    queue.complete(finished, claim, {})
+
+    assert queue.purge() == 0
+    assert queue.purge(time.time() + 61) == 1
+    assert queue.get(finished) is None
+    assert queue.get(waiting)["status"] == QUEUED
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from bench.fakes import FakeChatModel
+from utils import clients
+from utils import router as router_module
+from utils.router import ModelRouter
+
+PRIMARY, SECONDARY = clients.CHAT_DEPLOYMENTS
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+class ThrottledChatModel(FakeChatModel):
+    """
+    Fake deployment that answers 429 to its first `failures` calls.
+    """
+
+    def __init__(self, failures, **kwargs):
+        super().__init__(latency=0.0, jitter=0.0, **kwargs)
+        self.failures = failures
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise Throttled()
+        return await super().ainvoke(prompt)
+
+
+@pytest.fixture(autouse=True)
+def deployments(monkeypatch):
+    monkeypatch.setattr(clients, "_instances", {})
+    monkeypatch.setattr(router_module, "retry_delay", lambda error, attempt: 0.0)
+
+
+async def answered_by(chat):
+    await chat.ainvoke("Plan a data pipeline")
+    return chat.deployment_name
+
+
+def test_slow_deployment_is_hedged_to_the_next_one():
+    clients.set_chat_model(PRIMARY, FakeChatModel(latency=1.0, jitter=0.0, deployment_name="slow"))
+    clients.set_chat_model(SECONDARY, FakeChatModel(latency=0.01, jitter=0.0, deployment_name="fast"))
+    router = ModelRouter(hedge_after=0.05)
+
+    assert asyncio.run(router.acall(PRIMARY, answered_by)) == "fast"
+
+
+def test_throttled_deployment_fails_over_to_the_next_one():
+    throttled = ThrottledChatModel(failures=1, deployment_name="throttled")
+    clients.set_chat_model(PRIMARY, throttled)
+    clients.set_chat_model(SECONDARY, FakeChatModel(latency=0.01, jitter=0.0, deployment_name="healthy"))
+    router = ModelRouter(hedge=False)
+
+    assert asyncio.run(router.acall(PRIMARY, answered_by)) == "healthy"
+    assert throttled.calls == 1
+    assert router.health(PRIMARY).consecutive_failures == 1
+
+
+def test_failing_deployment_is_skipped_once_its_circuit_opens():
+    clients.set_chat_model(PRIMARY, ThrottledChatModel(failures=100, deployment_name="down"))
+    clients.set_chat_model(SECONDARY, FakeChatModel(latency=0.01, jitter=0.0, deployment_name="up"))
+    router = ModelRouter(hedge=False, failure_threshold=2, cooldown=60)
+
+    for _ in range(2):
+        asyncio.run(router.acall(PRIMARY, answered_by))
+    assert router.order(PRIMARY) == [SECONDARY]
+
+
+def test_call_is_retried_once_every_deployment_failed():
+    throttled = ThrottledChatModel(failures=2, deployment_name="only")
+    clients.set_chat_model(PRIMARY, throttled)
+    router = ModelRouter(hedge=False, retries=2)
+
+    assert asyncio.run(router.acall(PRIMARY, answered_by)) == "only"
+    assert throttled.calls == 3
+
+    clients.set_chat_model(PRIMARY, ThrottledChatModel(failures=1, deployment_name="only"))
+    router = ModelRouter(hedge=False, retries=0)
+    with pytest.raises(Throttled):
+        asyncio.run(router.acall(PRIMARY, answered_by))
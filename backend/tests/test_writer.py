@@ -0,0 +1,47 @@
+import pytest
+
+from utils.history import History, project_key
+from utils.writer import WriteBehindHistories
+
+
+def milestones(title, count=2):
+    return [{"index": i, "title": f"{title} {i}", "description": "d", "time": 1, "roles": ["Design"],
+             "deliverables": ["Report"]} for i in range(1, count + 1)]
+
+
+@pytest.fixture
+def writer(tmp_path):
+    # A long delay makes every write of a test land in the same group commit
+    writer = WriteBehindHistories(str(tmp_path / "history.db"), max_delay=0.2)
+    yield writer
+    writer.close()
+
+
+def test_poisoned_write_is_dropped_while_its_neighbours_commit(writer):
+    poisoned = milestones("Poisoned")
+    # Passes validation but cannot be serialized, so it fails inside the transaction
+    poisoned[0]["deliverables"] = [object()]
+    writer.insert_histories([History("", 1, "first", milestones=milestones("First"))])
+    writer.insert_histories([History("", 2, "poisoned", milestones=poisoned)])
+    writer.insert_histories([History("", 3, "last", milestones=milestones("Last"))])
+    writer.flush()
+
+    assert writer.get_milestones_by_key("1", project_key("first"))[0]["title"] == "First 1"
+    assert writer.get_milestones_by_key("3", project_key("last"))[0]["title"] == "Last 1"
+    assert writer.get_milestones_by_key("2", project_key("poisoned")) == []
+    assert not writer._pending
+
+
+def test_queued_writes_to_one_project_become_consecutive_versions(writer):
+    for title in ("Draft", "Review", "Final"):
+        writer.insert_histories([History("", 1, "project", milestones=milestones(title))])
+    # Reads see the newest queued write before it is committed
+    assert writer.get_milestones_by_key("1", project_key("project"))[0]["title"] == "Final 1"
+    writer.flush()
+
+    key = project_key("project")
+    versions = [version for version, _ in writer.get_versions("1", key)]
+    assert sorted(versions) == [1, 2, 3]
+    titles = [writer.get_version("1", key, version)["milestones"][0]["title"] for version in (1, 2, 3)]
+    assert titles == ["Draft 1", "Review 1", "Final 1"]
+    assert writer.get_milestones_by_key("1", key)[0]["title"] == "Final 1"
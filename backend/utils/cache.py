@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import time
+
+from utils.db import ConnectionPool, evict
+from utils.metrics import metrics
+
+
+def model_key(model):
+    """Name of the deployment behind a chat model, used to namespace cache keys."""
+    return (getattr(model, "deployment_name", None)
+            or getattr(model, "model_name", None)
+            or type(model).__name__)
+
+
+class ResponseCache:
+    """
+    Content-addressed store for LLM responses, kept in its own SQLite file.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted once the table grows past `max_entries`.
+    """
+
+    def __init__(self, db_loc='llm_cache.db', ttl=7 * 24 * 3600, max_entries=5000):
+        self.db_loc = db_loc
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.pool = ConnectionPool(db_loc)
+        self.create_database()
+
+    def create_database(self):
+        with self.pool.transaction() as c:
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache(
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)')
+
+    @staticmethod
+    def make_key(deployment, kind, prompt):
+        digest = hashlib.sha256()
+        for part in (deployment, kind, prompt):
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.pool.cursor() as c:
+            c.execute('SELECT value, created_at FROM llm_cache WHERE key = ?', (key,))
+            result = c.fetchone()
+        if result is None:
+            metrics.record_cache("llm", hit=False)
+            return None
+
+        value, created_at = result
+        with self.pool.transaction() as c:
+            if self.ttl and now - created_at > self.ttl:
+                c.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+                value = None
+            else:
+                c.execute('UPDATE llm_cache SET last_access = ? WHERE key = ?', (now, key))
+        metrics.record_cache("llm", hit=value is not None)
+        return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self.pool.transaction() as c:
+            c.execute('''
+                INSERT OR REPLACE INTO llm_cache (key, value, created_at, last_access)
+                VALUES (?, ?, ?, ?)
+            ''', (key, value, now, now))
+            evict(c, 'llm_cache', now, self.ttl, self.max_entries)
+
+    async def aget(self, key):
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key, value):
+        await asyncio.to_thread(self.set, key, value)
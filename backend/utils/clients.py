@@ -0,0 +1,142 @@
+"""
+Process-wide registry of Azure OpenAI clients.
+
+Clients are built on first use from environment variables and then shared, so
+a worker pays the import and TLS handshake costs once instead of per request.
+Every client reuses the same pooled keep-alive httpx connections.
+"""
+import os
+import threading
+
+# Display name -> suffix of the AZURE_OPENAI_* environment variables holding its settings
+CHAT_DEPLOYMENTS = {
+    "GPT 4o": "",
+    "GPT 3.5 Turbo": "1",
+}
+DEFAULT_CHAT_MODEL = "GPT 4o"
+
+_lock = threading.RLock()
+_instances = {}
+
+
+def _env(name):
+    try:
+        return os.environ[name]
+    except KeyError as e:
+        raise RuntimeError(f"Environment variable {e.args[0]} not set.") from e
+
+
+def _get(key, build):
+    instance = _instances.get(key)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(key)
+            if instance is None:
+                instance = _instances[key] = build()
+    return instance
+
+
+def _limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=int(os.environ.get("AZURE_OPENAI_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.environ.get("AZURE_OPENAI_MAX_KEEPALIVE", 20)),
+        keepalive_expiry=float(os.environ.get("AZURE_OPENAI_KEEPALIVE_EXPIRY", 60)),
+    )
+
+
+def http_client():
+    import httpx
+
+    return _get("http_client", lambda: httpx.Client(limits=_limits(), timeout=httpx.Timeout(120, connect=10)))
+
+
+def http_async_client():
+    import httpx
+
+    return _get("http_async_client",
+                lambda: httpx.AsyncClient(limits=_limits(), timeout=httpx.Timeout(120, connect=10)))
+
+
+def configured_chat_models():
+    """
+    Names of the chat deployments whose settings are present in the environment.
+    """
+    return [name for name, suffix in CHAT_DEPLOYMENTS.items()
+            if (name, "chat") in _instances or f"AZURE_OPENAI_CHAT_DEPLOYMENT_NAME{suffix}" in os.environ]
+
+
+def _build_chat(name):
+    from langchain_openai import AzureChatOpenAI
+
+    if name not in CHAT_DEPLOYMENTS:
+        raise ValueError(f"Unknown model {name!r}. Expected one of {', '.join(CHAT_DEPLOYMENTS)}.")
+    suffix = CHAT_DEPLOYMENTS[name]
+    try:
+        return AzureChatOpenAI(
+            openai_api_version=_env(f"AZURE_OPENAI_API_VERSION{suffix}"),
+            azure_deployment=_env(f"AZURE_OPENAI_CHAT_DEPLOYMENT_NAME{suffix}"),
+            api_key=_env(f"AZURE_OPENAI_API_KEY{suffix}"),
+            azure_endpoint=_env(f"AZURE_OPENAI_ENDPOINT{suffix}"),
+            # ModelRouter retries and fails over itself; SDK retries would hold a call on a throttled deployment
+            max_retries=0,
+            http_client=http_client(),
+            http_async_client=http_async_client(),
+        )
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Failed to initialize Azure OpenAI services: {str(e)}") from e
+
+
+def _build_embeddings():
+    from langchain_openai import AzureOpenAIEmbeddings
+
+    try:
+        return AzureOpenAIEmbeddings(
+            openai_api_version=_env("AZURE_OPENAI_API_VERSION"),
+            azure_deployment=os.environ.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME")
+            or _env("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"),
+            model="text-embedding-ada-002",
+            http_client=http_client(),
+            http_async_client=http_async_client(),
+        )
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Failed to initialize Azure OpenAI services: {str(e)}") from e
+
+
+def chat_model(name=DEFAULT_CHAT_MODEL):
+    return _get((name, "chat"), lambda: _build_chat(name))
+
+
+def embeddings():
+    return _get("embeddings", _build_embeddings)
+
+
+def set_chat_model(name, model):
+    """
+    Replaces a chat deployment, e.g. with a local fake for benchmarks.
+    """
+    with _lock:
+        _instances[(name, "chat")] = model
+
+
+def set_embeddings(model):
+    with _lock:
+        _instances["embeddings"] = model
+
+
+async def aclose():
+    """
+    Closes the shared connection pools and forgets every client.
+    """
+    with _lock:
+        instances = dict(_instances)
+        _instances.clear()
+    if "http_async_client" in instances:
+        await instances["http_async_client"].aclose()
+    if "http_client" in instances:
+        instances["http_client"].close()
@@ -0,0 +1,93 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """
+    Hands out one reusable SQLite connection per thread.
+
+    Connections run in WAL mode so readers never block the writer, wait on
+    `busy_timeout` instead of failing with "database is locked", and keep a
+    per-connection cache of prepared statements across requests.
+    """
+
+    def __init__(self, db_loc, busy_timeout=5000, synchronous="NORMAL", cached_statements=256):
+        self.db_loc = db_loc
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_loc,
+            timeout=self.busy_timeout / 1000,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute('PRAGMA foreign_keys=ON')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Yields a cursor inside a transaction that commits on success and rolls back on error.
+        """
+        conn = self.connection()
+        c = conn.cursor()
+        try:
+            yield c
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            c.close()
+
+    @contextmanager
+    def cursor(self):
+        """
+        Yields a cursor for read-only statements.
+        """
+        c = self.connection().cursor()
+        try:
+            yield c
+        finally:
+            c.close()
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+def evict(c, table, now, ttl=None, max_entries=None):
+    """
+    Expires rows of a cache `table` older than `ttl` seconds, then deletes the least
+    recently used ones beyond `max_entries`. The table needs `key`, `created_at`
+    and `last_access` columns.
+    """
+    if ttl:
+        c.execute(f'DELETE FROM {table} WHERE created_at < ?', (now - ttl,))
+    if max_entries:
+        c.execute(f'''
+            DELETE FROM {table} WHERE key IN (
+                SELECT key FROM {table} ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+        ''', (max_entries,))
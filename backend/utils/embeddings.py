@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils import clients
+from utils.db import ConnectionPool, evict
+from utils.metrics import metrics
+
+
+class EmbeddingStore:
+    """
+    Memoizes embedding vectors by text hash.
+
+    Recently used vectors live in a bounded in-memory LRU; every vector is also
+    persisted as a float32 blob in SQLite so they survive restarts. Texts that are
+    missing from both are embedded together in a single `embed_documents` batch.
+
+    Stored vectors expire after `ttl` seconds and the least recently loaded ones
+    are evicted once the table grows past `max_entries`, like ResponseCache.
+    """
+
+    def __init__(self, embeddings=None, db_loc='embeddings.db', max_memory_entries=2048,
+                 ttl=30 * 24 * 3600, max_entries=20000):
+        self._embeddings = embeddings
+        self.db_loc = db_loc
+        self.max_memory_entries = max_memory_entries
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.pool = ConnectionPool(db_loc)
+        self.create_database()
+
+    @property
+    def embeddings(self):
+        # Falls back to the shared client so it is only built once something needs embedding
+        return self._embeddings or clients.embeddings()
+
+    @embeddings.setter
+    def embeddings(self, embeddings):
+        self._embeddings = embeddings
+
+    @property
+    def namespace(self):
+        embeddings = self.embeddings
+        return f"{getattr(embeddings, 'deployment', None)}:{getattr(embeddings, 'model', None)}"
+
+    def create_database(self):
+        with self.pool.transaction() as c:
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings(
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL DEFAULT 0,
+                    last_access REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            self._migrate_timestamps(c)
+            c.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)')
+
+    def _migrate_timestamps(self, c):
+        # Stores created before eviction existed lack the timestamps; their vectors start fresh
+        c.execute('PRAGMA table_info(embeddings)')
+        columns = [row[1] for row in c.fetchall()]
+        for column in ("created_at", "last_access"):
+            if column not in columns:
+                c.execute(f'ALTER TABLE embeddings ADD COLUMN {column} REAL NOT NULL DEFAULT 0')
+        now = time.time()
+        c.execute('UPDATE embeddings SET created_at = ?, last_access = ? WHERE created_at = 0', (now, now))
+
+    def _key(self, text, namespace=None):
+        namespace = self.namespace if namespace is None else namespace
+        return hashlib.sha256(f"{namespace}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            now = time.time()
+            with self.pool.cursor() as c:
+                c.execute(f'''
+                    SELECT key, vector FROM embeddings
+                    WHERE key IN ({', '.join('?' * len(missing))}) AND (? = 0 OR created_at >= ?)
+                ''', [*missing, self.ttl or 0, now - (self.ttl or 0)])
+                rows = c.fetchall()
+            if rows:
+                # Memory hits stay in memory, so disk recency only tracks loads from disk
+                with self.pool.transaction() as c:
+                    c.executemany('UPDATE embeddings SET last_access = ? WHERE key = ?',
+                                  [(now, key) for key, _ in rows])
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+                self._remember(key, found[key])
+
+        return found
+
+    def _store(self, pairs):
+        now = time.time()
+        with self.pool.transaction() as c:
+            c.executemany('''
+                INSERT OR REPLACE INTO embeddings (key, vector, created_at, last_access) VALUES (?, ?, ?, ?)
+            ''', [(key, vector.tobytes(), now, now) for key, vector in pairs])
+            evict(c, 'embeddings', now, self.ttl, self.max_entries)
+        for key, vector in pairs:
+            self._remember(key, vector)
+
+    def _plan(self, texts):
+        namespace = self.namespace
+        keys = [self._key(text, namespace) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        # Deduplicate while preserving order so each missing text is embedded once
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        metrics.record_cache("embeddings", hit=True, count=len(found))
+        metrics.record_cache("embeddings", hit=False, count=len(missing))
+        return keys, found, missing
+
+    @staticmethod
+    def _collect(keys, found, missing, vectors):
+        pairs = [(key, np.asarray(vector, dtype=np.float32)) for key, vector in zip(missing, vectors)]
+        found.update(pairs)
+        return pairs, [found[key] for key in keys]
+
+    def embed_many(self, texts):
+        """
+        Returns one float32 vector per text, calling the embedding model at most once.
+        """
+        keys, found, missing = self._plan(texts)
+        if not missing:
+            return [found[key] for key in keys]
+
+        vectors = self.embeddings.embed_documents(list(missing.values()))
+        pairs, result = self._collect(keys, found, missing, vectors)
+        self._store(pairs)
+        return result
+
+    async def aembed_many(self, texts):
+        keys, found, missing = await asyncio.to_thread(self._plan, texts)
+        if not missing:
+            return [found[key] for key in keys]
+
+        vectors = await self.embeddings.aembed_documents(list(missing.values()))
+        pairs, result = self._collect(keys, found, missing, vectors)
+        await asyncio.to_thread(self._store, pairs)
+        return result
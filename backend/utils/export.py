@@ -0,0 +1,73 @@
+import json
+import zlib
+
+from utils.history import History, validate_history
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def gzip_ndjson(records, level=6):
+    """
+    Yields a gzip stream of one JSON document per line, compressing as records arrive.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for record in records:
+        chunk = compressor.compress((json.dumps(record) + "\n").encode("utf-8"))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+class NDJSONReader:
+    """
+    Incrementally decodes NDJSON, gzip-compressed or not, from arbitrary byte chunks.
+    """
+
+    def __init__(self):
+        self._decompressor = None
+        self._head = b""
+        self._started = False
+        self._buffer = b""
+
+    def _decode(self, chunk):
+        if not self._started:
+            # The format is only known once the first two bytes are in
+            self._head += chunk
+            if len(self._head) < len(GZIP_MAGIC):
+                return b""
+            chunk, self._head = self._head, b""
+            self._started = True
+            if chunk.startswith(GZIP_MAGIC):
+                self._decompressor = zlib.decompressobj(47)
+        return self._decompressor.decompress(chunk) if self._decompressor else chunk
+
+    def _lines(self, data, final=False):
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        if final:
+            lines.append(self._buffer)
+            self._buffer = b""
+        return [json.loads(line) for line in lines if line.strip()]
+
+    def feed(self, chunk):
+        return self._lines(self._decode(chunk)) if chunk else []
+
+    def close(self):
+        tail = self._decompressor.flush() if self._decompressor else self._head
+        return self._lines(tail, final=True)
+
+
+def history_from_record(record):
+    """
+    Rebuilds a History from an exported record. Raises ValueError when the record
+    could not be stored.
+    """
+    if not isinstance(record, dict):
+        raise ValueError(f"Expected a JSON object per line, got {type(record).__name__}.")
+    for field in ("user_id", "project_id"):
+        if not isinstance(record.get(field), (str, int)) or isinstance(record.get(field), bool):
+            raise ValueError(f"{field} must be a string or an integer.")
+    history_obj = History(record.get("history"), record["user_id"], record["project_id"],
+                          milestones=record.get("milestones"))
+    validate_history(history_obj)
+    return history_obj
@@ -1,70 +1,512 @@
-import sqlite3
+import asyncio
+import hashlib
 import json
+import re
+import sqlite3
+import time
+import zlib
+
+from utils.db import ConnectionPool
+
+
+# "3. Title | Duration: 2" -- anchored so '|' inside titles or descriptions is harmless
+MILESTONE_HEADING = re.compile(r'^(\d+)\. (.*) \| Duration: (\d+)$')
+
+
+def project_key(project_id):
+    """Short, stable digest of a project description used for indexed lookups."""
+    return hashlib.sha256(str(project_id).encode("utf-8")).hexdigest()[:32]
+
+
+MILESTONE_FIELDS = ("index", "title", "description", "time", "roles", "deliverables")
+
+
+def validate_history(history_obj):
+    """
+    Raises ValueError unless `history_obj` is a History that can be stored as is.
+    """
+    if not isinstance(history_obj, History):
+        raise ValueError(f"Expected a History, got {type(history_obj).__name__}.")
+    if not isinstance(history_obj.history, str):
+        raise ValueError(f"History {history_obj.id}: history must be a string.")
+    if history_obj.milestones is None:
+        return
+    if not isinstance(history_obj.milestones, list):
+        raise ValueError(f"History {history_obj.id}: milestones must be a list.")
+    for milestone in history_obj.milestones:
+        if not isinstance(milestone, dict) or any(field not in milestone for field in MILESTONE_FIELDS):
+            raise ValueError(f"History {history_obj.id}: milestones need {', '.join(MILESTONE_FIELDS)}.")
+        if not isinstance(milestone["index"], int):
+            raise ValueError(f"History {history_obj.id}: milestone index must be an integer.")
+
 
 class History:
-    def __init__(self, last_output: str, user_id, project_id):
+    def __init__(self, last_output: str, user_id, project_id, milestones=None):
         self.history = last_output
+        self.milestones = milestones
         self.user_id = str(user_id)
         self.project_id = str(project_id)
-        self.id = f"{project_id}x{user_id}"
+        self.project_key = project_key(self.project_id)
+        # Keyed on the digest so the (often multi-KB) description is stored once, in project_id
+        self.id = f"{self.project_key}x{self.user_id}"
 
     def __call__(self):
         return self.history
 
 
 class Histories:
-    def __init__(self, db_loc='history.db'):
+    def __init__(self, db_loc='history.db', max_versions=20):
         self.db_loc = db_loc
+        self.max_versions = max_versions
+        self.pool = ConnectionPool(db_loc)
+        self._listeners = []
         self.create_database()
 
+    def add_listener(self, callback):
+        """
+        Calls `callback(history_objs)` after every committed `insert_histories`.
+        """
+        self._listeners.append(callback)
+
     def create_database(self):
-        conn = sqlite3.connect(self.db_loc)
-        c = conn.cursor()
+        with self.pool.transaction() as c:
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS history(
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    project_id TEXT NOT NULL,
+                    history TEXT NOT NULL,
+                    project_key TEXT
+                )
+            ''')
+            self._migrate_project_keys(c)
+            c.execute('CREATE INDEX IF NOT EXISTS idx_history_user_project ON history(user_id, project_key)')
+            # Entries of an index on user_id are ordered by rowid, which keyset pagination relies on
+            c.execute('CREATE INDEX IF NOT EXISTS idx_history_user ON history(user_id)')
+            # One JSON row per milestone so single-milestone edits never touch the rest of the plan
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS milestones(
+                    user_id TEXT NOT NULL,
+                    project_key TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (user_id, project_key, idx)
+                )
+            ''')
+            self._migrate_plain_text_milestones(c)
+            # Every revision of a plan, zlib-compressed, newest version last
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS history_versions(
+                    user_id TEXT NOT NULL,
+                    project_key TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (user_id, project_key, version)
+                ) WITHOUT ROWID
+            ''')
+            self._migrate_compact_ids(c)
+            self._migrate_versions(c)
+            self._migrate_duplicate_text(c)
+
+    def _migrate_project_keys(self, c):
+        # Databases created before project keys existed lack the column
+        c.execute('PRAGMA table_info(history)')
+        if 'project_key' not in [row[1] for row in c.fetchall()]:
+            c.execute('ALTER TABLE history ADD COLUMN project_key TEXT')
+
+        c.execute('SELECT rowid, project_id FROM history WHERE project_key IS NULL')
+        rows = c.fetchall()
+        if rows:
+            c.executemany('UPDATE history SET project_key = ? WHERE rowid = ?',
+                          [(project_key(project_id), rowid) for rowid, project_id in rows])
+
+    def _migrate_plain_text_milestones(self, c):
+        # Plans stored before structured rows existed only have their plain-text form
         c.execute('''
-            CREATE TABLE IF NOT EXISTS history(
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                project_id TEXT NOT NULL,
-                history TEXT NOT NULL
+            SELECT h.user_id, h.project_key, h.history FROM history h
+            WHERE NOT EXISTS (
+                SELECT 1 FROM milestones m WHERE m.user_id = h.user_id AND m.project_key = h.project_key
             )
         ''')
-        conn.commit()
-        conn.close()
+        for user_id, key, history in c.fetchall():
+            try:
+                milestones = self.parse_plain_text_to_milestones(history)
+            except (ValueError, KeyError):
+                continue
+            self._write_milestones(c, user_id, key, milestones)
 
-    def insert_history(self, history_obj: History):
-        conn = sqlite3.connect(self.db_loc)
-        c = conn.cursor()
+    def _migrate_compact_ids(self, c):
+        # Ids used to embed the whole project description
+        c.execute("UPDATE history SET id = project_key || 'x' || user_id WHERE id != project_key || 'x' || user_id")
+
+    def _migrate_versions(self, c):
+        # Plans stored before versioning get their current state as version 1
         c.execute('''
-            INSERT OR REPLACE INTO history (id, user_id, project_id, history)
-            VALUES (?, ?, ?, ?)
-        ''', (history_obj.id, history_obj.user_id, history_obj.project_id, history_obj.history))
-        conn.commit()
-        conn.close()
+            SELECT h.user_id, h.project_key, h.history FROM history h
+            WHERE NOT EXISTS (
+                SELECT 1 FROM history_versions v WHERE v.user_id = h.user_id AND v.project_key = h.project_key
+            )
+        ''')
+        rows = c.fetchall()
+        if rows:
+            grouped = self._grouped_milestones(c, [(user_id, key) for user_id, key, _ in rows])
+            self._append_versions(c, [(user_id, key, history, grouped.get((user_id, key)))
+                                      for user_id, key, history in rows])
 
-    def get_history(self, user_id: str, project_id: str):
-        conn = sqlite3.connect(self.db_loc)
-        c = conn.cursor()
+    def _migrate_duplicate_text(self, c):
+        # The plain text of plans with milestone rows used to be stored as well
         c.execute('''
-            SELECT history FROM history
-            WHERE user_id = ? AND project_id = ?
-        ''', (user_id, project_id))
-        result = c.fetchone()
-        conn.close()
+            UPDATE history SET history = ''
+            WHERE history != '' AND EXISTS (
+                SELECT 1 FROM milestones m WHERE m.user_id = history.user_id AND m.project_key = history.project_key
+            )
+        ''')
+
+    def _stored_plan(self, history_obj):
+        """
+        Returns `(text, milestones)` as stored for a plan. The plain text is only kept
+        when there are no milestones to render it from.
+        """
+        milestones = history_obj.milestones
+        if milestones is None:
+            milestones = self.parse_plain_text_to_milestones(history_obj.history)
+        return ("" if milestones else history_obj.history), milestones
+
+    @staticmethod
+    def _compress_version(history, milestones):
+        plan = {"milestones": milestones} if milestones else {"history": history}
+        return zlib.compress(json.dumps(plan).encode("utf-8"), 9)
+
+    def _decompress_version(self, data):
+        plan = json.loads(zlib.decompress(data).decode("utf-8"))
+        plan.setdefault("milestones", None)
+        if "history" not in plan:
+            plan["history"] = self.convert_milestones_to_plain_text(plan["milestones"])
+        return plan
+
+    def _append_versions(self, c, plans):
+        """
+        Appends a version for each `(user_id, project_key, history, milestones)` and drops
+        versions beyond `max_versions` for those projects.
+        """
+        now = time.time()
+        c.executemany('''
+            INSERT INTO history_versions (user_id, project_key, version, created_at, data)
+            SELECT ?, ?, COALESCE(MAX(version), 0) + 1, ?, ? FROM history_versions
+            WHERE user_id = ? AND project_key = ?
+        ''', [(user_id, key, now, self._compress_version(history, milestones), user_id, key)
+              for user_id, key, history, milestones in plans])
+        if self.max_versions:
+            c.executemany('''
+                DELETE FROM history_versions
+                WHERE user_id = ? AND project_key = ? AND version <= (
+                    SELECT MAX(version) FROM history_versions WHERE user_id = ? AND project_key = ?
+                ) - ?
+            ''', [(user_id, key, user_id, key, self.max_versions) for user_id, key, _, _ in plans])
+
+    @staticmethod
+    def _write_milestones(c, user_id, key, milestones):
+        c.execute('DELETE FROM milestones WHERE user_id = ? AND project_key = ?', (user_id, key))
+        c.executemany('''
+            INSERT INTO milestones (user_id, project_key, idx, data) VALUES (?, ?, ?, ?)
+        ''', [(user_id, key, milestone['index'], json.dumps(milestone)) for milestone in milestones])
+
+    def insert_history(self, history_obj: History):
+        self.insert_histories([history_obj])
+
+    def insert_histories(self, history_objs):
+        """
+        Writes several plans, with their milestone rows, in one transaction. Each plan
+        becomes a new version; when a project appears more than once the last one is
+        its current plan.
+        """
+        if not history_objs:
+            return
+        for history_obj in history_objs:
+            validate_history(history_obj)
+        plans = [(history_obj, *self._stored_plan(history_obj)) for history_obj in history_objs]
+        current = {(history_obj.user_id, history_obj.project_key): (history_obj, text, milestones)
+                   for history_obj, text, milestones in plans}
+        with self.pool.transaction() as c:
+            # An upsert keeps the rowid, so rewritten plans hold their place in paginated listings
+            c.executemany('''
+                INSERT INTO history (id, user_id, project_id, project_key, history)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    user_id = excluded.user_id,
+                    project_id = excluded.project_id,
+                    project_key = excluded.project_key,
+                    history = excluded.history
+            ''', [(history_obj.id, history_obj.user_id, history_obj.project_id, history_obj.project_key, text)
+                  for history_obj, text, _ in current.values()])
+            c.executemany('DELETE FROM milestones WHERE user_id = ? AND project_key = ?', list(current))
+            c.executemany('''
+                INSERT OR REPLACE INTO milestones (user_id, project_key, idx, data) VALUES (?, ?, ?, ?)
+            ''', [(user_id, key, milestone['index'], json.dumps(milestone))
+                  for (user_id, key), (_, _, milestones) in current.items() for milestone in milestones])
+            self._append_versions(c, [(history_obj.user_id, history_obj.project_key, text, milestones)
+                                      for history_obj, text, milestones in plans])
+        for callback in self._listeners:
+            callback(history_objs)
+
+    def get_milestones(self, user_id: str, project_id: str):
+        """
+        Returns the structured milestones stored for a project, ordered by index.
+        """
+        return self.get_milestones_by_key(user_id, project_key(project_id))
+
+    def get_milestones_by_key(self, user_id: str, key: str):
+        with self.pool.cursor() as c:
+            c.execute('''
+                SELECT data FROM milestones
+                WHERE user_id = ? AND project_key = ?
+                ORDER BY idx
+            ''', (user_id, key))
+            return [json.loads(row[0]) for row in c.fetchall()]
+
+    def get_history(self, user_id: str, project_id: str):
+        milestones = self.get_milestones(user_id, project_id)
+        if milestones:
+            return self.convert_milestones_to_plain_text(milestones)
+
+        with self.pool.cursor() as c:
+            c.execute('''
+                SELECT history FROM history
+                WHERE user_id = ? AND project_key = ?
+            ''', (user_id, project_key(project_id)))
+            result = c.fetchone()
         if result:
             return result[0]
         else:
             return None
 
+    def get_all_histories(self):
+        with self.pool.cursor() as c:
+            c.execute('SELECT id, user_id, project_id, project_key, history FROM history')
+            rows = c.fetchall()
+            c.execute('SELECT user_id, project_key, data FROM milestones ORDER BY user_id, project_key, idx')
+            grouped = {}
+            for user_id, key, data in c:
+                grouped.setdefault((user_id, key), []).append(json.loads(data))
+
+        # Render from the structured rows, which are always the latest edit
+        return [
+            (id_, user_id, project_id,
+             self.convert_milestones_to_plain_text(grouped[(user_id, key)]) if (user_id, key) in grouped else history)
+            for id_, user_id, project_id, key, history in rows
+        ]
+
+    @staticmethod
+    def _grouped_milestones(c, projects):
+        """
+        Milestone rows of several `(user_id, project_key)` pairs, grouped by pair.
+        """
+        grouped = {}
+        projects = list(set(projects))
+        if not projects:
+            return grouped
+        c.execute(f'''
+            SELECT user_id, project_key, data FROM milestones
+            WHERE (user_id, project_key) IN (VALUES {', '.join(['(?, ?)'] * len(projects))})
+            ORDER BY user_id, project_key, idx
+        ''', [value for project in projects for value in project])
+        for user_id, key, data in c.fetchall():
+            grouped.setdefault((user_id, key), []).append(json.loads(data))
+        return grouped
+
+    def _history_record(self, row, grouped):
+        id_, user_id, project_id, key, history = row
+        milestones = grouped.get((user_id, key))
+        return {
+            "id": id_,
+            "user_id": user_id,
+            "project_id": project_id,
+            "project_key": key,
+            "history": self.convert_milestones_to_plain_text(milestones) if milestones else history,
+            "milestones": milestones,
+        }
+
+    def list_histories(self, user_id: str, after=0, limit=50):
+        """
+        Returns one page of a user's plans as `(records, next_cursor)`. Pages are keyed on
+        rowid, so each one is an index range scan no matter how deep it is.
+        """
+        with self.pool.cursor() as c:
+            c.execute('''
+                SELECT rowid, id, user_id, project_id, project_key, history FROM history
+                WHERE user_id = ? AND rowid > ?
+                ORDER BY rowid
+                LIMIT ?
+            ''', (user_id, after or 0, limit + 1))
+            rows = c.fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            grouped = self._grouped_milestones(c, [(row[2], row[4]) for row in rows])
+        records = [self._history_record(row[1:], grouped) for row in rows]
+        return records, (rows[-1][0] if more else None)
+
+    def export_histories(self, user_id=None, batch_size=200):
+        """
+        Yields every plan (or every plan of `user_id`) as a record, reading through a
+        cursor in batches so memory stays flat however many plans there are.
+        """
+        # A connection of its own: the generator may be resumed from different threads
+        conn = sqlite3.connect(self.db_loc, check_same_thread=False)
+        try:
+            rows = conn.cursor()
+            if user_id is None:
+                rows.execute('SELECT id, user_id, project_id, project_key, history FROM history ORDER BY rowid')
+            else:
+                rows.execute('''
+                    SELECT id, user_id, project_id, project_key, history FROM history
+                    WHERE user_id = ? ORDER BY rowid
+                ''', (user_id,))
+            lookup = conn.cursor()
+            while True:
+                batch = rows.fetchmany(batch_size)
+                if not batch:
+                    break
+                grouped = self._grouped_milestones(lookup, [(row[1], row[3]) for row in batch])
+                for row in batch:
+                    yield self._history_record(row, grouped)
+        finally:
+            conn.close()
+
     def update_history(self, milestone):
-        conn = sqlite3.connect(self.db_loc)
-        c = conn.cursor()
-        c.execute('''
-            UPDATE history
-            SET history = ?
-            WHERE id = ? AND user_id = ? AND project_id = ?
-        ''', (milestone.history, milestone.id, milestone.user_id, milestone.project_id))
-        conn.commit()
-        conn.close()
+        """
+        Replaces the plan of an existing project, leaving its id and position unchanged.
+        """
+        validate_history(milestone)
+        text, milestones = self._stored_plan(milestone)
+        with self.pool.transaction() as c:
+            c.execute('''
+                UPDATE history
+                SET history = ?
+                WHERE user_id = ? AND project_key = ?
+            ''', (text, milestone.user_id, milestone.project_key))
+            if c.rowcount:
+                self._write_milestones(c, milestone.user_id, milestone.project_key, milestones)
+                self._append_versions(c, [(milestone.user_id, milestone.project_key, text, milestones)])
+
+    def update_milestone(self, user_id: str, project_id: str, milestone_data):
+        """
+        Replaces a single stored milestone in place. Returns False when it does not exist.
+        """
+        with self.pool.transaction() as c:
+            c.execute('''
+                UPDATE milestones
+                SET data = ?
+                WHERE user_id = ? AND project_key = ? AND idx = ?
+            ''', (json.dumps(milestone_data), user_id, project_key(project_id), milestone_data['index']))
+            if c.rowcount == 0:
+                return False
+
+            # Edits are revisions too
+            key = project_key(project_id)
+            milestones = self._grouped_milestones(c, [(user_id, key)])[(user_id, key)]
+            self._append_versions(c, [(user_id, key, "", milestones)])
+            return True
+
+    def get_versions(self, user_id: str, key: str):
+        """
+        Returns `(version, created_at)` of every retained revision of a plan, oldest first.
+        """
+        with self.pool.cursor() as c:
+            c.execute('''
+                SELECT version, created_at FROM history_versions
+                WHERE user_id = ? AND project_key = ?
+                ORDER BY version
+            ''', (user_id, key))
+            return c.fetchall()
+
+    def get_version(self, user_id: str, key: str, version=None):
+        """
+        Returns one revision, the latest when `version` is None, or None if it is not retained.
+        """
+        with self.pool.cursor() as c:
+            if version is None:
+                c.execute('''
+                    SELECT version, created_at, data FROM history_versions
+                    WHERE user_id = ? AND project_key = ?
+                    ORDER BY version DESC LIMIT 1
+                ''', (user_id, key))
+            else:
+                c.execute('''
+                    SELECT version, created_at, data FROM history_versions
+                    WHERE user_id = ? AND project_key = ? AND version = ?
+                ''', (user_id, key, version))
+            row = c.fetchone()
+        if row is None:
+            return None
+        return {"version": row[0], "created_at": row[1], **self._decompress_version(row[2])}
+
+    def compact_versions(self, max_age=None):
+        """
+        Enforces `max_versions` on every plan and drops revisions older than `max_age`
+        seconds, always keeping each plan's latest one. Returns the number removed.
+        """
+        with self.pool.transaction() as c:
+            removed = 0
+            if self.max_versions:
+                c.execute('''
+                    DELETE FROM history_versions
+                    WHERE version <= (
+                        SELECT MAX(v.version) FROM history_versions v
+                        WHERE v.user_id = history_versions.user_id AND v.project_key = history_versions.project_key
+                    ) - ?
+                ''', (self.max_versions,))
+                removed += c.rowcount
+            if max_age:
+                c.execute('''
+                    DELETE FROM history_versions
+                    WHERE created_at < ? AND version < (
+                        SELECT MAX(v.version) FROM history_versions v
+                        WHERE v.user_id = history_versions.user_id AND v.project_key = history_versions.project_key
+                    )
+                ''', (time.time() - max_age,))
+                removed += c.rowcount
+            return removed
+
+    def close(self):
+        self.pool.close_all()
+
+    # Async wrappers so the event loop never blocks on SQLite I/O
+    async def ainsert_history(self, history_obj: History):
+        await asyncio.to_thread(self.insert_history, history_obj)
+
+    async def ainsert_histories(self, history_objs):
+        await asyncio.to_thread(self.insert_histories, history_objs)
+
+    async def aget_history(self, user_id: str, project_id: str):
+        return await asyncio.to_thread(self.get_history, user_id, project_id)
+
+    async def aupdate_history(self, milestone):
+        await asyncio.to_thread(self.update_history, milestone)
+
+    async def aget_all_histories(self):
+        return await asyncio.to_thread(self.get_all_histories)
+
+    async def aget_milestones(self, user_id: str, project_id: str):
+        return await asyncio.to_thread(self.get_milestones, user_id, project_id)
+
+    async def aget_milestones_by_key(self, user_id: str, key: str):
+        return await asyncio.to_thread(self.get_milestones_by_key, user_id, key)
+
+    async def alist_histories(self, user_id: str, after=0, limit=50):
+        return await asyncio.to_thread(self.list_histories, user_id, after, limit)
+
+    async def aget_versions(self, user_id: str, key: str):
+        return await asyncio.to_thread(self.get_versions, user_id, key)
+
+    async def aget_version(self, user_id: str, key: str, version=None):
+        return await asyncio.to_thread(self.get_version, user_id, key, version)
+
+    async def acompact_versions(self, max_age=None):
+        return await asyncio.to_thread(self.compact_versions, max_age)
+
+    async def aupdate_milestone(self, user_id: str, project_id: str, milestone_data):
+        return await asyncio.to_thread(self.update_milestone, user_id, project_id, milestone_data)
 
     def update_specific_milestone(self, project_history, milestone_data):
         milestones = self.parse_plain_text_to_milestones(project_history)
@@ -89,31 +531,36 @@ class Histories:
         current_milestone = {}
 
         for line in milestone_lines:
-            if '|' in line and 'Duration' in line:
+            line = line.strip()
+            heading = MILESTONE_HEADING.match(line)
+            if heading:
                 if current_milestone:
                     milestones.append(current_milestone)
-                milestone_index, rest = line.split('. ', 1)
-                title, duration = rest.split(' | Duration: ', 1)
                 current_milestone = {
-                    'index': int(milestone_index.strip()),
-                    'title': title.strip(),
-                    'time': int(duration.strip()),
+                    'index': int(heading.group(1)),
+                    'title': heading.group(2).strip(),
+                    'time': int(heading.group(3)),
                     'description': '',
                     'roles': [],
                     'deliverables': []
                 }
+            elif not current_milestone or not line:
+                continue
             elif line.startswith('Deliverables:'):
-                deliverables = line.split(':', 1)[1].strip().split(', ')
-                current_milestone['deliverables'] = deliverables
+                deliverables = line.split(':', 1)[1].strip()
+                current_milestone['deliverables'] = deliverables.split(', ') if deliverables else []
             elif line.startswith('Roles:'):
-                roles = line.split(':', 1)[1].strip().split(', ')
-                current_milestone['roles'] = roles
+                roles = line.split(':', 1)[1].strip()
+                current_milestone['roles'] = roles.split(', ') if roles else []
             else:
-                current_milestone['description'] += line.strip() + ' '
+                current_milestone['description'] += line + ' '
 
         if current_milestone:
             milestones.append(current_milestone)
 
+        for milestone in milestones:
+            milestone['description'] = milestone['description'].strip()
+
         return milestones
 
     def convert_milestones_to_plain_text(self, milestones):
@@ -0,0 +1,95 @@
+import re
+
+from utils.summarize import STOPWORDS, WORD
+
+ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6,
+    "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10,
+}
+
+# A milestone number; "2 weeks" in "milestone 3 to 2 weeks" is a duration, not a milestone
+NUMBER = r"#?\d+(?!\d|\s*(?:weeks?|wks?|days?|months?|hours?|hrs?|%|percent)\b)"
+# "milestone 3", "milestones 2 and 4", "milestone #2", "milestones 2-4"
+NUMBERED = re.compile(
+    rf"\bmilestones?\s*(?:#|no\.?\s*|number\s*)?({NUMBER}(?:\s*(?:,|and|&|or|-|to|through)\s*{NUMBER})*)", re.I)
+NUMBER_LIST = re.compile(r"(?:(,|and|&|or|-|to|through)\s*)?#?(\d+)", re.I)
+# "3rd milestone", "the third milestone", "last milestone"
+ORDINAL = re.compile(r"\b(\d+)(?:st|nd|rd|th)\s+milestone|\b(" + "|".join(ORDINALS) + r"|last|final)\s+milestone", re.I)
+
+# Requests that change the shape of the plan or all of it always regenerate everything
+STRUCTURAL = re.compile(
+    r"\b(add|insert|remove|delete|drop|merge|combine|split|reorder|swap)\s+"
+    r"(?:(?:a|an|another|one|two|the|new|extra|more|separate)\s+){0,2}milestones?\b"
+    r"|\b(fewer|more|less)\s+milestones\b|\b(new|extra|additional)\s+milestones?\b"
+    r"|\b(all|every|each|whole|entire|overall)\b(?:\W+\w+){0,2}?\W+(milestones?|plan)\b",
+    re.I,
+)
+
+IGNORED_TITLE_WORDS = STOPWORDS | {"milestone", "phase", "step"}
+
+
+def _content_words(text):
+    return {word.lower().strip(".-'") for word in WORD.findall(str(text))} - IGNORED_TITLE_WORDS - {""}
+
+
+def _numbered(modifying_prompt):
+    indices = set()
+    for match in NUMBERED.finditer(modifying_prompt):
+        previous = None
+        for separator, number in NUMBER_LIST.findall(match.group(1)):
+            number = int(number)
+            if separator.lower() in ("-", "to", "through"):
+                # "4 to 1" is a move, not a range: only the first number is a reference
+                if previous is not None and number > previous:
+                    indices.update(range(previous, number + 1))
+                continue
+            indices.add(number)
+            previous = number
+    return indices
+
+
+def _ordinal(modifying_prompt, last_index):
+    indices = set()
+    for number, word in ORDINAL.findall(modifying_prompt):
+        if number:
+            indices.add(int(number))
+        elif word.lower() in ("last", "final"):
+            indices.add(last_index)
+        else:
+            indices.add(ORDINALS[word.lower()])
+    return indices
+
+
+def _by_title(modifying_prompt, milestones, min_overlap=0.6):
+    prompt_words = _content_words(modifying_prompt)
+    indices = set()
+    for milestone in milestones:
+        title_words = _content_words(milestone["title"])
+        if not title_words:
+            continue
+        if milestone["title"].lower() in modifying_prompt.lower() \
+                or len(title_words & prompt_words) / len(title_words) >= min_overlap:
+            indices.add(milestone["index"])
+    return indices
+
+
+def touched_milestones(modifying_prompt, milestones):
+    """
+    Works out which stored milestones a modifying prompt refers to, by number,
+    ordinal or title.
+
+    Returns the sorted milestone indices, or None when the change cannot be
+    localized (nothing referenced, every milestone referenced, or the plan's
+    structure changes) and the whole plan has to be regenerated.
+    """
+    if not modifying_prompt or not milestones or STRUCTURAL.search(modifying_prompt):
+        return None
+
+    existing = {milestone["index"] for milestone in milestones}
+    indices = _numbered(modifying_prompt) | _ordinal(modifying_prompt, max(existing))
+    indices |= _by_title(modifying_prompt, milestones)
+
+    # A reference to a milestone that does not exist means the request is not a local edit
+    if not indices or not indices <= existing or indices == existing:
+        return None
+    return sorted(indices)
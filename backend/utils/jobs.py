@@ -0,0 +1,256 @@
+import asyncio
+import json
+import time
+import uuid
+
+from utils.db import ConnectionPool
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    Durable job queue in SQLite, shared by every process pointing at the same file.
+
+    A worker claims the oldest queued job with a single conditional UPDATE and holds
+    it under a lease it keeps renewing. Jobs whose lease ran out, because the process
+    running them died or restarted, are queued again until `max_attempts` is reached.
+    Finished jobs are deleted once they are older than `retention_seconds` (None
+    keeps them forever).
+    """
+
+    def __init__(self, db_loc='jobs.db', lease_seconds=60, max_attempts=3, retention_seconds=7 * 24 * 3600):
+        self.db_loc = db_loc
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._next_purge = 0.0
+        self.pool = ConnectionPool(db_loc)
+        self.create_database()
+
+    def create_database(self):
+        with self.pool.transaction() as c:
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS jobs(
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claim TEXT,
+                    leased_until REAL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)')
+
+    def enqueue(self, kind, payload):
+        job_id = uuid.uuid4().hex
+        with self.pool.transaction() as c:
+            c.execute('''
+                INSERT INTO jobs (id, kind, status, payload, created_at) VALUES (?, ?, ?, ?, ?)
+            ''', (job_id, kind, QUEUED, json.dumps(payload), time.time()))
+        return job_id
+
+    def claim(self):
+        """
+        Leases the oldest runnable job. Returns `(id, kind, payload, claim)` or None.
+        """
+        now = time.time()
+        claim = uuid.uuid4().hex
+        with self.pool.transaction() as c:
+            c.execute('''
+                UPDATE jobs SET status = ?, error = 'Worker stopped responding too many times', finished_at = ?
+                WHERE status = ? AND leased_until < ? AND attempts >= ?
+            ''', (FAILED, now, RUNNING, now, self.max_attempts))
+            c.execute('''
+                UPDATE jobs
+                SET status = ?, claim = ?, leased_until = ?, attempts = attempts + 1, started_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE status = ? OR (status = ? AND leased_until < ?)
+                    ORDER BY created_at LIMIT 1
+                )
+                RETURNING id, kind, payload
+            ''', (RUNNING, claim, now + self.lease_seconds, now, QUEUED, RUNNING, now))
+            row = c.fetchone()
+        if row is None:
+            return None
+        job_id, kind, payload = row
+        return job_id, kind, json.loads(payload), claim
+
+    def renew(self, job_id, claim):
+        """
+        Extends a lease. Returns False when the job has been handed to another worker.
+        """
+        with self.pool.transaction() as c:
+            c.execute('UPDATE jobs SET leased_until = ? WHERE id = ? AND claim = ? AND status = ?',
+                      (time.time() + self.lease_seconds, job_id, claim, RUNNING))
+            return c.rowcount > 0
+
+    def _finish(self, job_id, claim, status, result=None, error=None):
+        with self.pool.transaction() as c:
+            c.execute('''
+                UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, leased_until = NULL
+                WHERE id = ? AND claim = ?
+            ''', (status, result, error, time.time(), job_id, claim))
+
+    def complete(self, job_id, claim, result):
+        self._finish(job_id, claim, SUCCEEDED, result=json.dumps(result))
+
+    def fail(self, job_id, claim, error):
+        self._finish(job_id, claim, FAILED, error=error)
+
+    def release(self, job_id, claim):
+        """
+        Puts a claimed job back in the queue, e.g. when its worker shuts down.
+        """
+        with self.pool.transaction() as c:
+            c.execute('''
+                UPDATE jobs SET status = ?, claim = NULL, leased_until = NULL, attempts = attempts - 1
+                WHERE id = ? AND claim = ? AND status = ?
+            ''', (QUEUED, job_id, claim, RUNNING))
+
+    def purge(self, now=None):
+        """
+        Deletes succeeded and failed jobs that finished more than `retention_seconds`
+        ago. Returns the number of jobs deleted.
+        """
+        if self.retention_seconds is None:
+            return 0
+        now = time.time() if now is None else now
+        self._next_purge = now + min(self.retention_seconds, 3600)
+        with self.pool.transaction() as c:
+            c.execute('DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                      (SUCCEEDED, FAILED, now - self.retention_seconds))
+            return c.rowcount
+
+    def purge_if_due(self):
+        """
+        Runs `purge` at most once an hour (or once per retention period, if shorter).
+        """
+        now = time.time()
+        if now < self._next_purge:
+            return 0
+        return self.purge(now)
+
+    def get(self, job_id):
+        with self.pool.cursor() as c:
+            c.execute('''
+                SELECT id, kind, status, result, error, attempts, created_at, started_at, finished_at
+                FROM jobs WHERE id = ?
+            ''', (job_id,))
+            row = c.fetchone()
+        if row is None:
+            return None
+        job_id, kind, status, result, error, attempts, created_at, started_at, finished_at = row
+        return {
+            "job_id": job_id,
+            "kind": kind,
+            "status": status,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "attempts": attempts,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+        }
+
+    # Async wrappers so the event loop never blocks on SQLite I/O
+    async def aenqueue(self, kind, payload):
+        return await asyncio.to_thread(self.enqueue, kind, payload)
+
+    async def aclaim(self):
+        return await asyncio.to_thread(self.claim)
+
+    async def arenew(self, job_id, claim):
+        return await asyncio.to_thread(self.renew, job_id, claim)
+
+    async def acomplete(self, job_id, claim, result):
+        await asyncio.to_thread(self.complete, job_id, claim, result)
+
+    async def afail(self, job_id, claim, error):
+        await asyncio.to_thread(self.fail, job_id, claim, error)
+
+    async def arelease(self, job_id, claim):
+        await asyncio.to_thread(self.release, job_id, claim)
+
+    async def apurge_if_due(self):
+        return await asyncio.to_thread(self.purge_if_due)
+
+    async def aget(self, job_id):
+        return await asyncio.to_thread(self.get, job_id)
+
+
+class JobWorkers:
+    """
+    Runs `concurrency` asyncio workers that claim jobs and pass their payload to the
+    handler registered for the job's kind. The handler's return value must be JSON
+    serializable; an exception marks the job failed.
+    """
+
+    def __init__(self, queue, handlers, concurrency=2, poll_interval=1.0):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def notify(self):
+        """
+        Wakes idle workers right away instead of at their next poll.
+        """
+        self._wakeup.set()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _wait(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _keep_lease(self, job_id, claim):
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            if not await self.queue.arenew(job_id, claim):
+                return
+
+    async def _work(self):
+        while True:
+            job = await self.queue.aclaim()
+            if job is None:
+                await self.queue.apurge_if_due()
+                await self._wait()
+                continue
+
+            job_id, kind, payload, claim = job
+            lease = asyncio.create_task(self._keep_lease(job_id, claim))
+            try:
+                result = await self.handlers[kind](payload)
+            except asyncio.CancelledError:
+                # Shutting down: hand the job to the next worker instead of waiting for the lease to run out
+                await asyncio.shield(self.queue.arelease(job_id, claim))
+                raise
+            except Exception as e:
+                await self.queue.afail(job_id, claim, str(e))
+            else:
+                await self.queue.acomplete(job_id, claim, result)
+            finally:
+                lease.cancel()
@@ -0,0 +1,140 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage durations of the request currently being handled, for Server-Timing headers
+request_timings: ContextVar = ContextVar("request_timings", default=None)
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and histograms rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            position = bisect.bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                histogram[0][position] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Times a pipeline stage into the stage histogram and the current request's timings.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("milestone_stage_duration_seconds", elapsed, stage=stage)
+            timings = request_timings.get()
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+
+    def record_usage(self, cb, stage):
+        """
+        Adds the token, request and cost totals of a `get_openai_callback` handler.
+        """
+        self.inc("llm_tokens_total", cb.prompt_tokens, stage=stage, kind="prompt")
+        self.inc("llm_tokens_total", cb.completion_tokens, stage=stage, kind="completion")
+        self.inc("llm_requests_total", cb.successful_requests, stage=stage)
+        self.inc("llm_cost_usd_total", cb.total_cost, stage=stage)
+
+    def record_cache(self, cache, hit, count=1):
+        self.inc("cache_requests_total", count, cache=cache, result="hit" if hit else "miss")
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, _labels(labels)), 0)
+
+    def histogram_totals(self, name, **labels):
+        """
+        Returns `(sum, count)` of a histogram series, or zeros when it has no samples.
+        """
+        with self._lock:
+            histogram = self._histograms.get((name, _labels(labels)))
+            return (histogram[1], histogram[2]) if histogram else (0.0, 0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(buckets), total, count))
+                                for key, (buckets, total, count) in self._histograms.items())
+
+        lines = []
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("milestone_stage_duration_seconds", "Time spent in each milestone pipeline stage.")
+metrics.describe("http_request_duration_seconds", "End-to-end HTTP request latency.")
+metrics.describe("llm_tokens_total", "Tokens reported by the OpenAI callback handler.")
+metrics.describe("llm_requests_total", "Successful chat completion requests.")
+metrics.describe("llm_cost_usd_total", "Estimated chat completion cost in USD.")
+metrics.describe("cache_requests_total", "Cache lookups by cache and result.")
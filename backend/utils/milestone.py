@@ -1,12 +1,14 @@
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
-import os
-import pandas as pd
+import asyncio
 from langchain_community.callbacks import get_openai_callback
+from langchain_community.callbacks.openai_info import OpenAICallbackHandler
 from langchain_community.utils.math import cosine_similarity
 from langchain_core.pydantic_v1 import BaseModel, Field
 from typing import List
-import math
+import numpy as np
 from dotenv import load_dotenv
+from utils.cache import model_key
+from utils.prompts import PromptBuilder
+from utils import clients
 
 load_dotenv(".env")
 
@@ -31,97 +33,229 @@ class Milestone(BaseModel):
 class ListOfMilestones(BaseModel):
     milestones: List[Milestone] = Field(description="Milestone details this project can be divided in (keep <=6)")
 
+    @classmethod
+    def from_records(cls, records):
+        """
+        Rebuilds a plan from stored milestone rows, whose roles are plain strings.
+        """
+        return cls(milestones=[
+            Milestone(**{**record, "roles": [PeopleRole(roles=role) for role in record["roles"]]})
+            for record in records
+        ])
+
+    @staticmethod
+    def distribute_weeks(num_milestones, total_weeks):
+        # Start with 1 week per milestone and hand out any left over round-robin
+        time = [1] * num_milestones
+        for i in range(total_weeks - num_milestones):
+            time[i % num_milestones] += 1
+        return time
+
+    def records(self, total_weeks):
+        """
+        The plan as JSON-ready rows, at most one per week, with weeks redistributed
+        over the milestones. Same rows as `dataframe(total_weeks)`, without pandas.
+        """
+        # Ensure the number of milestones does not exceed the total weeks
+        selected_milestones = self.milestones[:min(len(self.milestones), total_weeks)]
+        if not selected_milestones:
+            return []
+        time = self.distribute_weeks(len(selected_milestones), total_weeks)
+        return [
+            {
+                "title": ms.title,
+                "descriptions": ms.description,
+                "time": weeks,
+                "roles": [{"roles": role.roles} for role in ms.roles],
+                "deliverables": list(ms.deliverables),
+            }
+            for ms, weeks in zip(selected_milestones, time)
+        ]
+
     def dataframe(self, total_weeks):
+        # pandas is heavy to import and only needed here
+        import pandas as pd
+
         # Ensure the number of milestones does not exceed the total weeks
         num_milestones = min(len(self.milestones), total_weeks)
         selected_milestones = self.milestones[:num_milestones]
 
-        # Distribute the time proportionally
-        time = [1] * num_milestones  # Start with 1 week per milestone
-        remaining_weeks = total_weeks - num_milestones
-
-        # If any weeks are left, distribute them proportionally
-        for i in range(remaining_weeks):
-            time[i % num_milestones] += 1
-
         df = pd.DataFrame({
             "title": [ms.title for ms in selected_milestones],
             "descriptions": [ms.description for ms in selected_milestones],
-            "time": time,
+            "time": self.distribute_weeks(num_milestones, total_weeks),
             "roles": [ms.roles for ms in selected_milestones],
             "deliverables": [ms.deliverables for ms in selected_milestones]
         })
         return df
 
 
-embeddings = AzureOpenAIEmbeddings(
-    openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-    azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
-)
-
-our_embedding_model = embeddings.embed_query
-
-
 class MilestonePlanning:
-    def __init__(self, detailed, summarized, total_weeks, model=None, embedding_model=None):
+    def __init__(self, detailed, summarized, total_weeks, model=None, embedding_model=None,
+                 async_embedding_model=None, cache=None, embedding_store=None, prompt_builder=None):
         self.list_of_milestones = None
+        self.cache = cache
+        self.prompts = prompt_builder or PromptBuilder()
+        self.tokens_trimmed = 0
+        self.embedding_store = embedding_store
+        self.cache_hit = False
         self.detailed_description = detailed
         self.summarized_description = summarized
         self.total_weeks = total_weeks  # Added this line to keep track of total weeks
 
-        # Ensure the model is correctly set
+        # Ensure the model is correctly set, reusing the shared client instead of building one per plan
         if model is None:
-            self.model = AzureChatOpenAI(
-                openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-                azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
-                max_retries=2,
-            )
+            self.model = clients.chat_model()
         else:
             self.model = model
 
-        # Ensure the embedding model is correctly set
-        if embedding_model is None:
-            self.embedding_model = our_embedding_model
+        # Embedding models default to the shared client, resolved only when evaluating
+        self._embedding_model = embedding_model
+        self._async_embedding_model = async_embedding_model
+
+    @property
+    def embedding_model(self):
+        return self._embedding_model or clients.embeddings().embed_query
+
+    @property
+    def async_embedding_model(self):
+        return self._async_embedding_model or clients.embeddings().aembed_query
+
+    def _milestones_prompt(self, modifying_prompt=None, model_last_output=None):
+        if modifying_prompt is None:
+            prompt, self.tokens_trimmed = self.prompts.milestones(
+                self.detailed_description, self.summarized_description, self.total_weeks)
         else:
-            self.embedding_model = embedding_model
+            prompt, self.tokens_trimmed = self.prompts.modification(model_last_output, modifying_prompt)
+        return prompt
+
+    def reuse_milestones(self, list_of_milestones):
+        """
+        Adopts an existing plan instead of extracting one; no tokens are spent.
+        """
+        self.list_of_milestones = list_of_milestones
+        self.cache_hit = True
+        self.callbacks = OpenAICallbackHandler()
+
+    def _cache_key(self, prompt):
+        return self.cache.make_key(model_key(self.model), "milestones", prompt)
 
     def extract_milestones(self, modifying_prompt=None, model_last_output=None, json=False):
+        prompt = self._milestones_prompt(modifying_prompt, model_last_output)
         try:
             with get_openai_callback() as cb:
-                if modifying_prompt is None:
-                    # Adapt the prompt to limit the number of milestones based on total_weeks
+                cached = self.cache.get(self._cache_key(prompt)) if self.cache else None
+                self.cache_hit = cached is not None
+                if self.cache_hit:
+                    self.list_of_milestones = ListOfMilestones.parse_raw(cached)
+                else:
                     self.list_of_milestones = self.model.with_structured_output(
                         ListOfMilestones, method='function_calling'
-                    ).invoke(
-                        f"""\
-                            Generate up to {min(6, self.total_weeks)} technical milestones for the following project, including details like the job roles required, time to complete, and key deliverables for each milestone. 
+                    ).invoke(prompt)
+                    if self.cache:
+                        self.cache.set(self._cache_key(prompt), self.list_of_milestones.json())
 
-                            Detailed Description:
-                            {self.detailed_description}
+                self.callbacks = cb
+        except Exception as e:
+            return e
 
-                            Summarized Description:
-                            {self.summarized_description}
-                            """
-                    )
+        return self.list_of_milestones
+
+    async def aextract_milestones(self, modifying_prompt=None, model_last_output=None):
+        prompt = self._milestones_prompt(modifying_prompt, model_last_output)
+        try:
+            with get_openai_callback() as cb:
+                cached = await self.cache.aget(self._cache_key(prompt)) if self.cache else None
+                self.cache_hit = cached is not None
+                if self.cache_hit:
+                    self.list_of_milestones = ListOfMilestones.parse_raw(cached)
                 else:
-                    self.list_of_milestones = self.model.with_structured_output(
+                    self.list_of_milestones = await self.model.with_structured_output(
                         ListOfMilestones, method='function_calling'
-                    ).invoke(
-                        f"""\
-                            Previous Output:
-                            {model_last_output}
+                    ).ainvoke(prompt)
+                    if self.cache:
+                        await self.cache.aset(self._cache_key(prompt), self.list_of_milestones.json())
 
-                            Modify the technical milestones for the project according to this query:
-                            {modifying_prompt}
-                            """
-                    )
+                self.callbacks = cb
+        except Exception as e:
+            return e
+
+        return self.list_of_milestones
+
+    def _regeneration_prompt(self, modifying_prompt, previous, indices):
+        previous_output = "".join(self._textify_milestone_one(milestone) for milestone in previous.milestones)
+        prompt, self.tokens_trimmed = self.prompts.regeneration(previous_output, modifying_prompt, indices)
+        return prompt
+
+    async def aregenerate_milestones(self, modifying_prompt, previous, indices):
+        """
+        Regenerates only the milestones at `indices` of the `previous` ListOfMilestones
+        and splices them into it, so output tokens scale with the edit, not the plan.
+        """
+        prompt = self._regeneration_prompt(modifying_prompt, previous, indices)
+        try:
+            with get_openai_callback() as cb:
+                cached = await self.cache.aget(self._cache_key(prompt)) if self.cache else None
+                self.cache_hit = cached is not None
+                if self.cache_hit:
+                    regenerated = ListOfMilestones.parse_raw(cached)
+                else:
+                    regenerated = await self.model.with_structured_output(
+                        ListOfMilestones, method='function_calling'
+                    ).ainvoke(prompt)
+                    if self.cache:
+                        await self.cache.aset(self._cache_key(prompt), regenerated.json())
 
                 self.callbacks = cb
         except Exception as e:
             return e
 
+        replacements = {milestone.index: milestone for milestone in regenerated.milestones}
+        if len(indices) == 1 and len(regenerated.milestones) == 1:
+            # A single rewritten milestone is the one asked for, whatever index the model gave it
+            replacements = {indices[0]: regenerated.milestones[0]}
+        milestones = []
+        for milestone in previous.milestones:
+            replacement = replacements.get(milestone.index) if milestone.index in indices else None
+            milestones.append(replacement.copy(update={"index": milestone.index}) if replacement else milestone)
+        self.list_of_milestones = ListOfMilestones(milestones=milestones)
         return self.list_of_milestones
 
+    async def astream_milestones(self, modifying_prompt=None, model_last_output=None):
+        """
+        Yields each Milestone as soon as its part of the structured output has been parsed.
+        """
+        prompt = self._milestones_prompt(modifying_prompt, model_last_output)
+        with get_openai_callback() as cb:
+            cached = await self.cache.aget(self._cache_key(prompt)) if self.cache else None
+            self.cache_hit = cached is not None
+            if self.cache_hit:
+                self.list_of_milestones = ListOfMilestones.parse_raw(cached)
+                for milestone in self.list_of_milestones.milestones:
+                    yield milestone
+            else:
+                emitted = 0
+                # Streamed completions only report token usage when asked to, in the last chunk
+                async for chunk in self.model.with_structured_output(
+                    ListOfMilestones, method='function_calling'
+                ).astream(prompt, stream_options={"include_usage": True}):
+                    if not isinstance(chunk, ListOfMilestones):
+                        continue
+                    self.list_of_milestones = chunk
+                    # The last milestone may still be streaming in; only emit the ones before it
+                    while emitted < len(chunk.milestones) - 1:
+                        yield chunk.milestones[emitted]
+                        emitted += 1
+
+                if self.list_of_milestones is None:
+                    raise Exception("The model did not return any milestones.")
+                for milestone in self.list_of_milestones.milestones[emitted:]:
+                    yield milestone
+                if self.cache:
+                    await self.cache.aset(self._cache_key(prompt), self.list_of_milestones.json())
+
+            self.callbacks = cb
+
     def _textify_milestones(self):
         if not self.list_of_milestones.milestones:
             raise Exception("extract_milestones() not called before textify!")
@@ -134,26 +268,117 @@ class MilestonePlanning:
 
     def _textify_milestone_one(self, milestone):
         assert type(milestone) == Milestone, f"Milestone type inconsistent with what was expected. Received {type(milestone)}"
-        text = f"""{milestone.index}. {milestone.title} | Duration: {milestone.time}
-            {milestone.description}
-            Deliverables: {', '.join(milestone.deliverables)}
-            """
+        text = (f"{milestone.index}. {milestone.title} | Duration: {milestone.time}\n"
+                f"{milestone.description}\n"
+                f"Deliverables: {', '.join(milestone.deliverables)}\n"
+                f"Roles: {', '.join(role.roles for role in milestone.roles)}\n")
         return text
 
+    def _structured_milestones(self):
+        if not self.list_of_milestones.milestones:
+            raise Exception("extract_milestones() not called before structuring!")
+
+        return [
+            {
+                "index": milestone.index,
+                "title": milestone.title,
+                "description": milestone.description,
+                "roles": [role.roles for role in milestone.roles],
+                "deliverables": list(milestone.deliverables),
+                "time": milestone.time,
+            }
+            for milestone in self.list_of_milestones.milestones
+        ]
+
     def evaluate_milestones(self, with_summary=False):
         milestones_text = self._textify_milestones()
+        description = self.summarized_description if with_summary else self.detailed_description
+
+        if self.embedding_store is not None:
+            # One batched call for whatever the store has not seen yet
+            milestone_embedding, description_embedding = self.embedding_store.embed_many(
+                [milestones_text, description])
+        else:
+            milestone_embedding = self.embedding_model(milestones_text)
+            description_embedding = self.embedding_model(description)
+
+        self.similarity = cosine_similarity([milestone_embedding], [description_embedding]).item()
 
-        milestone_embedding = self.embedding_model(milestones_text)
+        return self.similarity
 
-        if not with_summary:
-            description_embedding = self.embedding_model(self.detailed_description)
+    async def aevaluate_milestones(self, with_summary=False):
+        milestones_text = self._textify_milestones()
+        description = self.summarized_description if with_summary else self.detailed_description
+
+        if self.embedding_store is not None:
+            milestone_embedding, description_embedding = await self.embedding_store.aembed_many(
+                [milestones_text, description])
         else:
-            description_embedding = self.embedding_model(self.summarized_description)
+            # Both embeddings are independent, so request them concurrently
+            milestone_embedding, description_embedding = await asyncio.gather(
+                self.async_embedding_model(milestones_text),
+                self.async_embedding_model(description),
+            )
 
-        self.similarity = cosine_similarity(milestone_embedding, description_embedding).item()
+        self.similarity = cosine_similarity([milestone_embedding], [description_embedding]).item()
 
         return self.similarity
 
+    def _per_milestone_inputs(self, with_summary):
+        if not self.list_of_milestones.milestones:
+            raise Exception("extract_milestones() not called before evaluation!")
+
+        description = self.summarized_description if with_summary else self.detailed_description
+        texts = [self._textify_milestone_one(milestone) for milestone in self.list_of_milestones.milestones]
+        return texts + [description]
+
+    def _similarity_report(self, vectors, redundancy_threshold):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+
+        # Rows are milestones; columns are every milestone followed by the description
+        similarity = matrix[:-1] @ matrix.T
+        to_description = similarity[:, -1]
+        between = similarity[:, :-1]
+
+        indices = [milestone.index for milestone in self.list_of_milestones.milestones]
+        rows, cols = np.nonzero(np.triu(between >= redundancy_threshold, k=1))
+
+        self.similarity = float(to_description.mean())
+        return {
+            "average_similarity": self.similarity,
+            "milestone_scores": [
+                {"index": index, "similarity": float(score)} for index, score in zip(indices, to_description)
+            ],
+            "redundant_pairs": [
+                {"first": indices[i], "second": indices[j], "similarity": float(between[i, j])}
+                for i, j in zip(rows, cols)
+            ],
+            "similarity_matrix": between.astype(float).round(4).tolist(),
+        }
+
+    def evaluate_per_milestone(self, with_summary=False, redundancy_threshold=0.9):
+        """
+        Scores every milestone against the description and against each other.
+        """
+        texts = self._per_milestone_inputs(with_summary)
+        if self.embedding_store is not None:
+            vectors = self.embedding_store.embed_many(texts)
+        else:
+            vectors = [self.embedding_model(text) for text in texts]
+
+        return self._similarity_report(vectors, redundancy_threshold)
+
+    async def aevaluate_per_milestone(self, with_summary=False, redundancy_threshold=0.9):
+        texts = self._per_milestone_inputs(with_summary)
+        if self.embedding_store is not None:
+            vectors = await self.embedding_store.aembed_many(texts)
+        else:
+            vectors = await asyncio.gather(*(self.async_embedding_model(text) for text in texts))
+
+        return self._similarity_report(vectors, redundancy_threshold)
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,201 @@
+from utils.history import MILESTONE_HEADING
+from utils.incremental import touched_milestones
+from utils.metrics import metrics
+from utils.summarize import estimate_tokens, rank_sentences, split_sentences
+
+# Input token budgets per model-bound stage, instructions included
+DEFAULT_BUDGETS = {
+    "summary": 6000,
+    "extract": 3000,
+    "modify": 4000,
+}
+
+
+def fit_to_budget(text, budget):
+    """
+    Returns `(text, trimmed)`: the highest ranked sentences of `text`, in their original
+    order, that fit in `budget` tokens, and how many tokens were dropped.
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= budget:
+        return text, 0
+    if budget <= 0:
+        return "", tokens
+
+    sentences = split_sentences(text)
+    kept, used = [], 0
+    for position in rank_sentences(sentences):
+        cost = estimate_tokens(sentences[position])
+        if used + cost <= budget:
+            kept.append(position)
+            used += cost
+
+    if kept:
+        fitted = " ".join(sentences[position] for position in sorted(kept))
+    else:
+        # A single sentence longer than the budget: cut it at a word boundary
+        words, used = [], 0
+        for word in str(text).split():
+            used += estimate_tokens(word)
+            if used > budget:
+                break
+            words.append(word)
+        fitted = " ".join(words)
+    return fitted, tokens - estimate_tokens(fitted)
+
+
+def overlaps(summary, detailed, threshold=0.8):
+    """
+    True when most of the summary's sentences appear verbatim in the detailed text,
+    as they do for extractive summaries.
+    """
+    sentences = split_sentences(summary)
+    if not sentences:
+        return True
+    return sum(sentence in detailed for sentence in sentences) / len(sentences) >= threshold
+
+
+def _plan_blocks(text):
+    """
+    Splits a plain-text plan into `(index, title, lines)` blocks, one per milestone heading.
+    """
+    blocks = []
+    for line in str(text).split("\n"):
+        heading = MILESTONE_HEADING.match(line.strip())
+        if heading:
+            blocks.append((int(heading.group(1)), heading.group(2).strip(), [line]))
+        elif blocks:
+            blocks[-1][2].append(line)
+        else:
+            blocks.append((None, "", [line]))
+    return blocks
+
+
+def fit_previous_output(text, budget, relevant=None):
+    """
+    Shrinks a plain-text plan to `budget` tokens. Milestones outside `relevant` are cut
+    down to their heading line first, then the remaining bodies share what is left.
+    Returns `(text, trimmed)`.
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= budget:
+        return text, 0
+
+    blocks = _plan_blocks(text)
+    if relevant:
+        blocks = [(index, title, lines if index in relevant or index is None else lines[:1])
+                  for index, title, lines in blocks]
+        compressed = "\n".join(line for _, _, lines in blocks for line in lines)
+        if estimate_tokens(compressed) <= budget:
+            return compressed, tokens - estimate_tokens(compressed)
+
+    headings = sum(estimate_tokens(lines[0]) for index, _, lines in blocks if index is not None)
+    bodies = [index for index, _, lines in blocks if len(lines) > 1 or index is None]
+    share = max(0, budget - headings) // max(1, len(bodies))
+
+    fitted = []
+    for index, _, lines in blocks:
+        if index is None:
+            fitted.append(fit_to_budget("\n".join(lines), share)[0])
+            continue
+        fitted.append(lines[0])
+        if len(lines) > 1:
+            body, _ = fit_to_budget("\n".join(line for line in lines[1:] if line.strip()), share)
+            if body:
+                fitted.append(body)
+    text = "\n".join(fitted) + "\n"
+    return text, tokens - estimate_tokens(text)
+
+
+class PromptBuilder:
+    """
+    Builds the chat prompts of every stage within a per-stage input token budget,
+    counted locally with `estimate_tokens`, and reports how many tokens it trimmed.
+    """
+
+    def __init__(self, budgets=None):
+        self.budgets = {**DEFAULT_BUDGETS, **(budgets or {})}
+
+    def _record(self, stage, trimmed):
+        if trimmed:
+            metrics.inc("prompt_tokens_trimmed_total", trimmed, stage=stage)
+        return trimmed
+
+    def summary(self, description):
+        template = "Summarize the following project description: {description}"
+        available = self.budgets["summary"] - estimate_tokens(template.format(description=""))
+        description, trimmed = fit_to_budget(description, available)
+        return template.format(description=description), self._record("summary", trimmed)
+
+    def milestones(self, detailed, summarized, total_weeks):
+        trimmed = 0
+        if summarized and summarized != detailed and overlaps(summarized, detailed):
+            # The summary only repeats sentences of the description
+            trimmed += estimate_tokens(summarized)
+            summarized = detailed
+
+        count = min(6, total_weeks)
+        if summarized == detailed or not summarized:
+            template = """\
+                Generate up to {count} technical milestones for the following project, including details like the job roles required, time to complete, and key deliverables for each milestone. 
+
+                Detailed Description:
+                {detailed}
+                """
+            available = self.budgets["extract"] - estimate_tokens(template.format(count=count, detailed=""))
+            detailed, cut = fit_to_budget(detailed, available)
+            prompt = template.format(count=count, detailed=detailed)
+            return prompt, self._record("extract", trimmed + cut)
+
+        # Adapt the prompt to limit the number of milestones based on total_weeks
+        template = """\
+                Generate up to {count} technical milestones for the following project, including details like the job roles required, time to complete, and key deliverables for each milestone. 
+
+                Detailed Description:
+                {detailed}
+
+                Summarized Description:
+                {summarized}
+                """
+        available = self.budgets["extract"] - estimate_tokens(template.format(count=count, detailed="", summarized=""))
+        summary_budget = min(estimate_tokens(summarized), max(0, available) // 3)
+        summarized, cut_summary = fit_to_budget(summarized, summary_budget)
+        detailed, cut_detailed = fit_to_budget(detailed, available - estimate_tokens(summarized))
+        prompt = template.format(count=count, detailed=detailed, summarized=summarized)
+        return prompt, self._record("extract", trimmed + cut_summary + cut_detailed)
+
+    def modification(self, previous_output, modifying_prompt):
+        template = """\
+                Previous Output:
+                {previous}
+
+                Modify the technical milestones for the project according to this query:
+                {query}
+                """
+        available = self.budgets["modify"] - estimate_tokens(template.format(previous="", query=modifying_prompt))
+        relevant = touched_milestones(modifying_prompt, [
+            {"index": index, "title": title} for index, title, _ in _plan_blocks(previous_output) if index is not None
+        ])
+        previous_output, trimmed = fit_previous_output(previous_output, available, relevant)
+        prompt = template.format(previous=previous_output, query=modifying_prompt)
+        return prompt, self._record("modify", trimmed)
+
+    def regeneration(self, previous_output, modifying_prompt, indices):
+        numbers = ", ".join(str(index) for index in indices)
+        template = """\
+                Previous Output:
+                {previous}
+
+                Modify only milestone(s) {numbers} of the plan above according to this query:
+                {query}
+
+                Return only the modified milestone(s) {numbers}, keeping their index numbers. Do not return any other milestone.
+                """
+        available = self.budgets["modify"] - estimate_tokens(
+            template.format(previous="", numbers=numbers, query=modifying_prompt))
+        previous_output, trimmed = fit_previous_output(previous_output, available, set(indices))
+        prompt = template.format(previous=previous_output, numbers=numbers, query=modifying_prompt)
+        return prompt, self._record("modify", trimmed)
+
+
+metrics.describe("prompt_tokens_trimmed_total", "Estimated input tokens dropped to keep prompts within budget.")
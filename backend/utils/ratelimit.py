@@ -0,0 +1,27 @@
+import asyncio
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """
+    Async sliding-window limiter allowing at most `rate` acquisitions per `period` seconds.
+    """
+
+    def __init__(self, rate, period=60.0):
+        self.rate = rate
+        self.period = period
+        self._calls = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Holding the lock while sleeping keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.rate:
+                    self._calls.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self._calls[0]))
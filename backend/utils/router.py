@@ -0,0 +1,321 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+from utils import clients
+from utils.metrics import metrics
+
+
+def is_retryable(error):
+    """
+    Throttling, server errors, timeouts and dropped connections are worth another
+    deployment; anything else (bad request, auth, parsing) would fail there too.
+    """
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)) \
+        or type(error).__name__ in ("APITimeoutError", "APIConnectionError")
+
+
+def retry_delay(error, attempt, base=0.5, cap=8.0):
+    """
+    Seconds to wait before retrying a deployment: its Retry-After header when it
+    sent one, exponential backoff otherwise.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return min(cap, float(headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return min(cap, base * 2 ** attempt)
+
+
+class DeploymentHealth:
+    """
+    Rolling latency window and circuit breaker state of one chat deployment.
+    """
+
+    def __init__(self, window=100, failure_threshold=5, cooldown=30.0):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def p95(self, min_samples):
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def available(self, now):
+        # Once the cooldown has passed the breaker is half-open and lets calls through again
+        return now >= self.open_until
+
+    def success(self, latency):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def failure(self, now):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.open_until = now + self.cooldown
+            return True
+        return False
+
+
+class ModelRouter:
+    """
+    Routes chat calls across the configured deployments in `clients.CHAT_DEPLOYMENTS`.
+
+    The requested deployment is tried first unless its rolling p95 misses `slo` and
+    another deployment meets it. When a call outlives the p95 of its deployment
+    (or `hedge_after` before enough samples exist), a hedged duplicate goes to the
+    next deployment and the first answer wins. Throttling and server errors fail
+    over at once, and a deployment that keeps failing is skipped for `cooldown`.
+    Once every deployment has failed, the call is retried up to `retries` times
+    with backoff; the clients themselves are built without retries.
+    """
+
+    def __init__(self, slo=20.0, hedge=True, hedge_after=15.0, min_samples=20, window=100,
+                 failure_threshold=5, cooldown=30.0, retries=2):
+        self.slo = slo
+        self.retries = retries
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.min_samples = min_samples
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def health(self, name):
+        with self._lock:
+            health = self._health.get(name)
+            if health is None:
+                health = self._health[name] = DeploymentHealth(self.window, self.failure_threshold, self.cooldown)
+            return health
+
+    def model(self, name=clients.DEFAULT_CHAT_MODEL):
+        if name not in clients.CHAT_DEPLOYMENTS:
+            raise ValueError(f"Unknown model {name!r}. Expected one of {', '.join(clients.CHAT_DEPLOYMENTS)}.")
+        return RoutedChatModel(self, name)
+
+    def order(self, preferred):
+        """
+        Deployments to try for a call, best first.
+        """
+        now = time.monotonic()
+        names = clients.configured_chat_models()
+        if preferred in names:
+            names.remove(preferred)
+            names.insert(0, preferred)
+        elif not names:
+            # Nothing configured: let the client report which settings are missing
+            names = [preferred]
+        available = [name for name in names if self.health(name).available(now)]
+        if not available:
+            # Every breaker is open; trying beats failing outright
+            return names
+
+        def expected(name):
+            p95 = self.health(name).p95(self.min_samples)
+            return self.slo if p95 is None else p95
+
+        if expected(available[0]) > self.slo:
+            fastest = min(available, key=expected)
+            if expected(fastest) <= self.slo:
+                available.remove(fastest)
+                available.insert(0, fastest)
+        return available
+
+    def hedge_delay(self, name):
+        p95 = self.health(name).p95(self.min_samples)
+        return self.hedge_after if p95 is None else p95
+
+    async def _attempt(self, name, call):
+        start = time.perf_counter()
+        try:
+            result = await call(clients.chat_model(name))
+        except asyncio.CancelledError:
+            metrics.inc("llm_deployment_requests_total", deployment=name, outcome="cancelled")
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                if self.health(name).failure(time.monotonic()):
+                    metrics.inc("llm_circuit_opened_total", deployment=name)
+            metrics.inc("llm_deployment_requests_total", deployment=name, outcome="error")
+            raise
+        elapsed = time.perf_counter() - start
+        self.health(name).success(elapsed)
+        metrics.inc("llm_deployment_requests_total", deployment=name, outcome="success")
+        metrics.observe("llm_deployment_latency_seconds", elapsed, deployment=name)
+        return result
+
+    async def acall(self, preferred, call):
+        """
+        Runs `call(chat_model)` with routing, hedging and failover; returns the first success.
+        """
+        remaining = self.order(preferred)
+        pending = {}
+        last_error = None
+        attempt = 0
+
+        def launch():
+            name = remaining.pop(0)
+            pending[asyncio.ensure_future(self._attempt(name, call))] = name
+            return name
+
+        latest = launch()
+        try:
+            while pending:
+                timeout = self.hedge_delay(latest) if self.hedge and remaining else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    latest = launch()
+                    metrics.inc("llm_hedged_requests_total", deployment=latest)
+                    continue
+
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                    if not is_retryable(last_error):
+                        raise last_error
+                    if remaining:
+                        latest = launch()
+                        metrics.inc("llm_failovers_total", deployment=latest)
+                    elif not pending and attempt < self.retries:
+                        # Every deployment failed: back off, then start over with the best one
+                        await asyncio.sleep(retry_delay(last_error, attempt))
+                        attempt += 1
+                        remaining = self.order(preferred)
+                        latest = launch()
+                        metrics.inc("llm_retries_total", deployment=latest)
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def call(self, preferred, call):
+        """
+        Synchronous counterpart of `acall`: fails over in order, without hedging.
+        """
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(retry_delay(last_error, attempt - 1))
+            for name in self.order(preferred):
+                start = time.perf_counter()
+                try:
+                    result = call(clients.chat_model(name))
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    self.health(name).failure(time.monotonic())
+                    last_error = e
+                    continue
+                self.health(name).success(time.perf_counter() - start)
+                return result
+        raise last_error
+
+    async def astream(self, preferred, stream):
+        """
+        Yields from `stream(chat_model)`, failing over only until the first chunk arrives.
+        """
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(retry_delay(last_error, attempt - 1))
+            for name in self.order(preferred):
+                start = time.perf_counter()
+                started = False
+                try:
+                    async for chunk in stream(clients.chat_model(name)):
+                        started = True
+                        yield chunk
+                except Exception as e:
+                    if started or not is_retryable(e):
+                        raise
+                    self.health(name).failure(time.monotonic())
+                    last_error = e
+                    continue
+                self.health(name).success(time.perf_counter() - start)
+                return
+        raise last_error
+
+    def snapshot(self):
+        with self._lock:
+            health = dict(self._health)
+        now = time.monotonic()
+        return {
+            name: {
+                "p95_seconds": state.p95(self.min_samples),
+                "error_rate": state.error_rate(),
+                "circuit_open": not state.available(now),
+            }
+            for name, state in health.items()
+        }
+
+
+class RoutedChatModel:
+    """
+    Chat model facade that sends every call through a ModelRouter. It keeps the
+    requested deployment's name so cache keys do not depend on which one answered.
+    """
+
+    def __init__(self, router, name):
+        self.router = router
+        self.name = name
+
+    @property
+    def deployment_name(self):
+        if self.name not in clients.configured_chat_models():
+            return self.name
+        return getattr(clients.chat_model(self.name), "deployment_name", None) or self.name
+
+    def invoke(self, prompt):
+        return self.router.call(self.name, lambda model: model.invoke(prompt))
+
+    async def ainvoke(self, prompt):
+        return await self.router.acall(self.name, lambda model: model.ainvoke(prompt))
+
+    def with_structured_output(self, schema, **kwargs):
+        return RoutedStructuredModel(self, schema, kwargs)
+
+
+class RoutedStructuredModel:
+    def __init__(self, chat, schema, kwargs):
+        self.chat = chat
+        self.schema = schema
+        self.kwargs = kwargs
+
+    def _bind(self, model):
+        return model.with_structured_output(self.schema, **self.kwargs)
+
+    def invoke(self, prompt):
+        return self.chat.router.call(self.chat.name, lambda model: self._bind(model).invoke(prompt))
+
+    async def ainvoke(self, prompt):
+        return await self.chat.router.acall(self.chat.name, lambda model: self._bind(model).ainvoke(prompt))
+
+    def astream(self, prompt, **kwargs):
+        return self.chat.router.astream(self.chat.name, lambda model: self._bind(model).astream(prompt, **kwargs))
+
+
+metrics.describe("llm_deployment_requests_total", "Chat calls per deployment by outcome.")
+metrics.describe("llm_deployment_latency_seconds", "Latency of successful chat calls per deployment.")
+metrics.describe("llm_hedged_requests_total", "Hedged duplicate calls sent to a deployment.")
+metrics.describe("llm_failovers_total", "Calls retried on a deployment after another failed.")
+metrics.describe("llm_retries_total", "Calls retried after every deployment failed.")
+metrics.describe("llm_circuit_opened_total", "Times a deployment's circuit breaker opened.")
@@ -0,0 +1,302 @@
+import queue
+import threading
+
+import numpy as np
+
+from utils.db import ConnectionPool
+from utils.metrics import metrics
+
+
+class ProjectIndex:
+    """
+    Nearest-neighbour index over unit-normalized embeddings of stored projects.
+
+    Each key is stored with its float32 vector in one SQLite row, so processes
+    sharing the file (API workers, job workers) always agree on which vector
+    belongs to which key. Every process keeps an in-memory matrix and appends
+    the rows added since it last looked before each use. Re-adding a key
+    supersedes its earlier row. Search is an exact brute-force inner product;
+    with `approximate=True` and faiss installed an HNSW graph is used instead.
+    """
+
+    def __init__(self, db_loc='projects_index.db', approximate=False):
+        self.db_loc = db_loc
+        self.approximate = approximate
+        self.pool = ConnectionPool(db_loc)
+        self._lock = threading.Lock()
+        self._keys = []
+        self._latest = {}
+        self._matrix = None
+        self._dim = None
+        self._ann = None
+        self._last_id = 0
+        with self.pool.transaction() as c:
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS vectors(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL UNIQUE,
+                    vector BLOB NOT NULL
+                )
+            ''')
+
+    def _refresh(self):
+        """
+        Appends rows written since the last call, by this process or any other, to the
+        in-memory matrix. Must be called with the lock held.
+        """
+        with self.pool.cursor() as c:
+            c.execute('SELECT id, key, vector FROM vectors WHERE id > ? ORDER BY id', (self._last_id,))
+            rows = c.fetchall()
+        if not rows:
+            return
+        self._last_id = rows[-1][0]
+
+        vectors, keys = [], []
+        for _, key, blob in rows:
+            vector = np.frombuffer(blob, dtype=np.float32)
+            if self._dim is None:
+                self._dim = vector.shape[0]
+            if vector.shape[0] != self._dim:
+                # Written with another embedding model; skipped rather than failing every search
+                continue
+            vectors.append(vector)
+            keys.append(key)
+        if not keys:
+            return
+
+        count = len(self._keys)
+        needed = count + len(keys)
+        if self._matrix is None or needed > self._matrix.shape[0]:
+            # Grow geometrically so appends stay amortized O(1)
+            grown = np.empty((max(needed, 2 * count, 64), self._dim), dtype=np.float32)
+            if count:
+                grown[:count] = self._matrix[:count]
+            self._matrix = grown
+        self._matrix[count:needed] = vectors
+        for row, key in enumerate(keys, start=count):
+            self._latest[key] = row
+        self._keys.extend(keys)
+        self._ann = None
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._latest)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._refresh()
+            return key in self._latest
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def add(self, key, vector):
+        vector = self._normalize(vector)
+        with self._lock:
+            self._refresh()
+            if self._dim is not None and vector.shape[0] != self._dim:
+                raise ValueError(f"Expected a {self._dim}-dimensional vector, got {vector.shape[0]}.")
+            with self.pool.transaction() as c:
+                c.execute('INSERT OR REPLACE INTO vectors (key, vector) VALUES (?, ?)', (key, vector.tobytes()))
+            self._refresh()
+
+    def close(self):
+        self.pool.close_all()
+
+    def _approximate_index(self):
+        if self._ann is None:
+            import faiss
+
+            index = faiss.IndexHNSWFlat(self._dim, 32, faiss.METRIC_INNER_PRODUCT)
+            index.add(np.ascontiguousarray(self._matrix[:len(self._keys)]))
+            self._ann = index
+        return self._ann
+
+    def search(self, vector, k=1, accept=None):
+        """
+        Returns up to `k` `(key, similarity)` pairs, best first. `accept` can filter keys.
+        """
+        vector = self._normalize(vector)
+        with self._lock:
+            self._refresh()
+            if self._matrix is None or not len(self._keys):
+                return []
+            keys, latest = self._keys, self._latest
+
+            if self.approximate and self._faiss_available():
+                candidates = min(len(keys), max(k * 4, 16))
+                scores, rows = self._approximate_index().search(vector[None, :], candidates)
+                ranked = [(int(row), float(score)) for row, score in zip(rows[0], scores[0]) if row >= 0]
+            else:
+                # Exact scores for every row; rows are walked best-first until enough are accepted
+                scores = np.asarray(self._matrix[:len(keys)] @ vector)
+                ranked = ((int(row), float(scores[row])) for row in np.argsort(-scores))
+
+        results = []
+        for row, score in ranked:
+            key = keys[row]
+            # Skip rows superseded by a later add of the same key
+            if latest.get(key) != row or (accept is not None and not accept(key)):
+                continue
+            results.append((key, score))
+            if len(results) == k:
+                break
+        return results
+
+    @staticmethod
+    def _faiss_available():
+        try:
+            import faiss  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+
+class SemanticPlanCache:
+    """
+    Reuses stored plans for new projects whose description embedding is close enough
+    to one already planned, and keeps hit-rate and latency-saved metrics.
+
+    With the default `scope="user"` only a user's own plans are reused; `"global"`
+    shares plans across users and has to be chosen explicitly.
+    """
+
+    def __init__(self, index, threshold=0.95, scope="user"):
+        self.index = index
+        self.threshold = threshold
+        self.scope = scope
+        self._miss_seconds = None
+
+    @staticmethod
+    def make_key(user_id, project_key):
+        return f"{user_id}\t{project_key}"
+
+    @staticmethod
+    def split_key(key):
+        user_id, project_key = key.split("\t", 1)
+        return user_id, project_key
+
+    def lookup(self, vector, user_id, exclude=None):
+        """
+        Returns `(user_id, project_key, similarity)` of the closest stored project above
+        the threshold. `exclude` is a project key never to match, e.g. the project itself.
+        """
+        prefix = f"{user_id}\t"
+
+        def accept(key):
+            if self.scope != "global" and not key.startswith(prefix):
+                return False
+            return key != f"{prefix}{exclude}"
+
+        matches = self.index.search(vector, k=1, accept=accept)
+        if not matches or matches[0][1] < self.threshold:
+            return None
+        key, similarity = matches[0]
+        return (*self.split_key(key), similarity)
+
+    def remember(self, user_id, project_key, vector):
+        key = self.make_key(user_id, project_key)
+        if key not in self.index:
+            self.index.add(key, vector)
+
+    def index_plans(self, plans, embed_many):
+        """
+        Adds `(user_id, project_key, description)` plans missing from the index, embedding
+        their descriptions with one `embed_many` call. Returns how many were added.
+        """
+        missing = {}
+        for user_id, project_key, description in plans:
+            key = self.make_key(user_id, project_key)
+            if key not in self.index:
+                missing.setdefault(key, description)
+        if not missing:
+            return 0
+        for key, vector in zip(missing, embed_many(list(missing.values()))):
+            self.index.add(key, vector)
+        return len(missing)
+
+    def backfill(self, histories, embed_many, batch_size=256):
+        """
+        Indexes every plan stored in `histories` that is not indexed yet.
+        """
+        added, batch = 0, []
+        for record in histories.export_histories():
+            batch.append((record["user_id"], record["project_key"], record["project_id"]))
+            if len(batch) >= batch_size:
+                added += self.index_plans(batch, embed_many)
+                batch = []
+        return added + self.index_plans(batch, embed_many)
+
+    def record(self, hit, seconds):
+        metrics.record_cache("semantic", hit=hit)
+        if not hit:
+            # Moving average of what a full generation costs, to estimate what a hit saves
+            self._miss_seconds = seconds if self._miss_seconds is None else 0.9 * self._miss_seconds + 0.1 * seconds
+        elif self._miss_seconds is not None:
+            metrics.inc("semantic_cache_seconds_saved_total", max(0.0, self._miss_seconds - seconds))
+
+
+class PlanIndexer:
+    """
+    Adds saved plans to a SemanticPlanCache on a background thread, so history writes
+    (imports, group commits) never wait on the embedding model. Plans submitted while
+    the thread is busy are embedded together, up to `batch_size` at a time.
+    """
+
+    def __init__(self, cache, embed_many, batch_size=256):
+        self.cache = cache
+        self.embed_many = embed_many
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="plan-indexer", daemon=True)
+        self._thread.start()
+
+    def submit(self, plans):
+        """
+        Queues `(user_id, project_key, description)` plans for indexing.
+        """
+        for plan in plans:
+            self._queue.put(plan)
+
+    def backfill(self, histories):
+        """
+        Queues every plan stored in `histories` that is not indexed yet.
+        """
+        self._queue.put(histories)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                if not isinstance(item, tuple):
+                    self.cache.backfill(item, self.embed_many, self.batch_size)
+                    continue
+                plans = [item]
+                while len(plans) < self.batch_size:
+                    try:
+                        plan = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if not isinstance(plan, tuple):
+                        # Keep the order: whatever is not a plan goes back for the next round
+                        self._queue.put(plan)
+                        break
+                    plans.append(plan)
+                self.cache.index_plans(plans, self.embed_many)
+            except Exception:
+                # The plans are saved; the next startup backfill picks them up
+                metrics.inc("semantic_index_errors_total", len(plans) if isinstance(item, tuple) else 1)
+
+    def close(self, timeout=5.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+metrics.describe("semantic_cache_seconds_saved_total", "Estimated generation time saved by semantic cache hits.")
+metrics.describe("semantic_index_errors_total", "Stored plans that could not be added to the semantic index.")
@@ -0,0 +1,49 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution.
+
+    Callers arriving while a call for the same key is in flight wait for that
+    call and receive its result (or exception) instead of starting their own.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, fn):
+        """
+        Returns `(result, shared)` where `shared` tells whether another caller started the work.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # Shield so a disconnecting caller does not cancel the work for everyone else
+        return await asyncio.shield(task), shared
+
+
+class KeyedLock:
+    """
+    One asyncio.Lock per key, created on demand and dropped once nobody holds or awaits it.
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
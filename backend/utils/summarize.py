@@ -0,0 +1,116 @@
+import math
+import re
+from collections import Counter
+
+from utils.cache import model_key
+
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+|\n+')
+WORD = re.compile(r"[A-Za-z0-9][A-Za-z0-9+#.\-']*")
+TOKEN = re.compile(r"\w+|[^\w\s]")
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers him
+his how i if in into is it its itself just me more most my no nor not now of off on once only or other our ours out
+over own same she should so some such than that the their theirs them then there these they this those through to
+too under until up very was we were what when where which while who whom why will with would you your yours
+""".split())
+
+
+def estimate_tokens(text):
+    """
+    Rough, offline token count: words and punctuation marks, which tracks BPE counts
+    closely enough for budgeting decisions on English text.
+    """
+    if not text:
+        return 0
+    return len(TOKEN.findall(str(text)))
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_SPLIT.split(str(text)) if sentence.strip()]
+
+
+def rank_sentences(sentences):
+    """
+    Returns sentence positions ordered by normalized content-word frequency, best first.
+    """
+    words = [[word.lower() for word in WORD.findall(sentence) if word.lower() not in STOPWORDS]
+             for sentence in sentences]
+    frequencies = Counter(word for sentence_words in words for word in sentence_words)
+    if not frequencies:
+        return list(range(len(sentences)))
+    top = max(frequencies.values())
+
+    scores = []
+    for position, sentence_words in enumerate(words):
+        if not sentence_words:
+            scores.append((0.0, position))
+            continue
+        score = sum(frequencies[word] / top for word in sentence_words) / math.sqrt(len(sentence_words))
+        scores.append((score, position))
+    return [position for _, position in sorted(scores, reverse=True)]
+
+
+def extractive_summary(text, max_sentences=6):
+    """
+    Picks the highest scoring sentences by normalized content-word frequency and
+    returns them in their original order.
+    """
+    sentences = split_sentences(text)
+    if len(sentences) <= max_sentences:
+        return " ".join(sentences)
+
+    chosen = sorted(rank_sentences(sentences)[:max_sentences])
+    return " ".join(sentences[position] for position in chosen)
+
+
+class Summarizer:
+    """
+    Produces the summarized description used by MilestonePlanning.
+
+    Short descriptions are passed through untouched, longer ones are condensed
+    locally with `extractive_summary`; the chat model is only used on request.
+    """
+
+    SKIPPED = "skipped"
+    EXTRACTIVE = "extractive"
+    LLM = "llm"
+
+    def __init__(self, cache=None, skip_below_tokens=300, max_sentences=6, prompt_builder=None):
+        self.cache = cache
+        self.prompt_builder = prompt_builder
+        self.skip_below_tokens = skip_below_tokens
+        self.max_sentences = max_sentences
+
+    def strategy(self, description, use_llm=False):
+        if use_llm:
+            return self.LLM
+        if estimate_tokens(description) < self.skip_below_tokens:
+            return self.SKIPPED
+        return self.EXTRACTIVE
+
+    async def asummarize(self, model, description, use_llm=False):
+        """
+        Returns `(summary, strategy, cached, tokens_trimmed)` for a project description.
+        """
+        strategy = self.strategy(description, use_llm)
+        if strategy == self.SKIPPED:
+            return description, strategy, False, 0
+        if strategy == self.EXTRACTIVE:
+            return extractive_summary(description, self.max_sentences), strategy, False, 0
+
+        if self.prompt_builder is not None:
+            prompt, trimmed = self.prompt_builder.summary(description)
+        else:
+            prompt, trimmed = f"Summarize the following project description: {description}", 0
+        key = self.cache.make_key(model_key(model), "summary", prompt) if self.cache else None
+
+        cached = await self.cache.aget(key) if self.cache else None
+        if cached is not None:
+            return cached, strategy, True, trimmed
+
+        summary_message = await model.ainvoke(prompt)
+        if self.cache:
+            await self.cache.aset(key, summary_message.content)
+        return summary_message.content, strategy, False, trimmed
@@ -0,0 +1,210 @@
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+
+from utils.history import Histories, project_key, validate_history
+from utils.metrics import metrics
+
+
+class WriteBehindHistories(Histories):
+    """
+    Histories whose plan writes return immediately and are committed by one
+    background thread in grouped transactions.
+
+    Writes wait up to `max_delay` seconds for company and are committed about
+    `max_batch` per transaction. Every write is kept, in order, so each one becomes
+    a version of its plan. Reads see the latest pending write, and `close` (also
+    run at exit) waits up to `flush_timeout` seconds for everything to reach disk.
+
+    A locked or busy database is retried with backoff. Any other failure of a
+    grouped commit is retried row by row, and rows that still fail are dropped.
+    """
+
+    def __init__(self, db_loc='history.db', max_batch=256, max_delay=0.02, retry_delay=0.5, max_versions=20,
+                 flush_timeout=10.0):
+        super().__init__(db_loc, max_versions)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.flush_timeout = flush_timeout
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        self._abandoned = False
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def insert_histories(self, history_objs):
+        # Bad input fails here, in the caller, rather than in the background thread
+        for history_obj in history_objs:
+            validate_history(history_obj)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("History writer is closed.")
+            for history_obj in history_objs:
+                self._pending.setdefault((history_obj.user_id, history_obj.project_key), []).append(history_obj)
+            self._condition.notify_all()
+
+    def _pending_history(self, user_id, key):
+        with self._condition:
+            writes = self._pending.get((str(user_id), key))
+            return writes[-1] if writes else None
+
+    def _run(self):
+        delay = self.retry_delay
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._abandoned or (not self._pending and self._closed):
+                    return
+            if not self._closed:
+                # Group commit: let a burst of writes pile up before taking the write lock
+                time.sleep(self.max_delay)
+
+            with self._condition:
+                batch, size = [], 0
+                for key, writes in self._pending.items():
+                    if size >= self.max_batch:
+                        break
+                    batch.append((key, list(writes)))
+                    size += len(writes)
+            try:
+                super().insert_histories([history_obj for _, writes in batch for history_obj in writes])
+            except sqlite3.OperationalError:
+                # Locked or busy: the whole batch is retried after a growing pause
+                metrics.inc("history_write_errors_total", kind="transient")
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_delay * 16)
+                continue
+            except Exception:
+                metrics.inc("history_write_errors_total", kind="batch")
+                batch = self._commit_one_by_one(batch)
+            else:
+                metrics.inc("history_write_batches_total")
+                metrics.inc("history_writes_total", size)
+                batch = [(key, len(writes)) for key, writes in batch]
+            delay = self.retry_delay
+            self._settle(batch)
+
+    def _commit_one_by_one(self, batch):
+        """
+        Commits each write of a failed batch on its own and returns, per project, how
+        many of its oldest writes are done with, committed or dropped. A transient
+        error leaves that write and the later ones of its project pending.
+        """
+        settled = []
+        for key, writes in batch:
+            done = 0
+            for history_obj in writes:
+                if self._abandoned:
+                    break
+                try:
+                    super().insert_histories([history_obj])
+                except sqlite3.OperationalError:
+                    metrics.inc("history_write_errors_total", kind="transient")
+                    break
+                except Exception as e:
+                    metrics.inc("history_writes_dropped_total")
+                    logging.getLogger(__name__).error("Dropped history write %s: %s", history_obj.id, e)
+                else:
+                    metrics.inc("history_writes_total")
+                done += 1
+            settled.append((key, done))
+        return settled
+
+    def _settle(self, batch):
+        with self._condition:
+            for key, done in batch:
+                # Writes only ever join the end of a project's queue, so the committed ones lead it
+                writes = self._pending.get(key, [])
+                del writes[:done]
+                if not writes:
+                    self._pending.pop(key, None)
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every write made so far is committed, for at most `timeout`
+        seconds (`flush_timeout` by default). Returns False on timeout.
+        """
+        with self._condition:
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: not self._pending or not self._thread.is_alive(),
+                                            self.flush_timeout if timeout is None else timeout)
+
+    def close(self, timeout=None):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(self.flush_timeout if timeout is None else timeout)
+        if self._thread.is_alive():
+            with self._condition:
+                self._abandoned = True
+                lost = sum(len(writes) for writes in self._pending.values())
+            if lost:
+                metrics.inc("history_writes_dropped_total", lost)
+                logging.getLogger(__name__).error("Closed with %d history writes not committed", lost)
+        super().close()
+
+    # Reads overlay the pending writes so callers always see their own writes
+
+    def get_milestones_by_key(self, user_id: str, key: str):
+        pending = self._pending_history(user_id, key)
+        if pending is not None:
+            if pending.milestones is not None:
+                return [dict(milestone) for milestone in pending.milestones]
+            return self.parse_plain_text_to_milestones(pending.history)
+        return super().get_milestones_by_key(user_id, key)
+
+    def get_all_histories(self):
+        with self._condition:
+            pending = [writes[-1] for writes in self._pending.values()]
+        rows = {row[0]: row for row in super().get_all_histories()}
+        for history_obj in pending:
+            text = (self.convert_milestones_to_plain_text(history_obj.milestones)
+                    if history_obj.milestones is not None else history_obj.history)
+            rows[history_obj.id] = (history_obj.id, history_obj.user_id, history_obj.project_id, text)
+        return list(rows.values())
+
+    def list_histories(self, user_id: str, after=0, limit=50):
+        # Cursors are rowids, which pending plans do not have yet
+        self.flush()
+        return super().list_histories(user_id, after, limit)
+
+    def export_histories(self, user_id=None, batch_size=200):
+        self.flush()
+        return super().export_histories(user_id, batch_size)
+
+    def get_versions(self, user_id: str, key: str):
+        # A pending plan becomes a version only once it is committed
+        if self._pending_history(user_id, key) is not None:
+            self.flush()
+        return super().get_versions(user_id, key)
+
+    def get_version(self, user_id: str, key: str, version=None):
+        if self._pending_history(user_id, key) is not None:
+            self.flush()
+        return super().get_version(user_id, key, version)
+
+    # In-place edits go to SQLite, so the plan they edit has to be there first
+
+    def update_history(self, milestone):
+        self.flush()
+        super().update_history(milestone)
+
+    def update_milestone(self, user_id: str, project_id: str, milestone_data):
+        if self._pending_history(user_id, project_key(project_id)) is not None:
+            self.flush()
+        return super().update_milestone(user_id, project_id, milestone_data)
+
+
+metrics.describe("history_writes_total", "Plans committed by the write-behind history writer.")
+metrics.describe("history_write_batches_total", "Grouped commits of the write-behind history writer.")
+metrics.describe("history_write_errors_total", "Failed write-behind commits by kind.")
+metrics.describe("history_writes_dropped_total", "Write-behind plan writes dropped after failing on their own.")
@@ -0,0 +1,37 @@
+"""
+Processes queued /jobs/ requests without serving HTTP, so generation capacity can
+be scaled apart from the API processes. Run the API with MILESTONE_JOB_WORKERS=0
+and start as many of these as needed, from the same directory:
+
+    python worker.py --workers 4
+"""
+import argparse
+import asyncio
+
+from api import JOB_HANDLERS, hms, job_queue, plan_indexer
+from utils import clients
+from utils.jobs import JobWorkers
+
+
+async def main(workers, poll_interval):
+    job_workers = JobWorkers(job_queue, JOB_HANDLERS, concurrency=workers, poll_interval=poll_interval)
+    job_workers.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await job_workers.stop()
+        await asyncio.to_thread(hms.close)
+        await asyncio.to_thread(plan_indexer.close)
+        await clients.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2,
+                        help="Jobs processed concurrently by this process")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between queue polls when idle")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.workers, args.poll_interval))
+    except KeyboardInterrupt:
+        pass